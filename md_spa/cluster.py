@@ -6,10 +6,14 @@
 """
 
 import os
+import warnings
 import numpy as np
 import matplotlib.pyplot as plt
 
-from md_spa.cython_modules import _clustering as clust
+try:
+    from md_spa.cython_modules import _clustering as clust
+except ImportError:
+    clust = None
 from md_spa.utils import data_manipulation as dm
 from md_spa.utils import file_manipulation as fm
 from md_spa import read_lammps as rl
@@ -35,25 +39,24 @@ def consolidate(target_dir, boxes, column_name, file_in="coord.lammpstrj", file_
     kwargs_analysis : dict, default={}
         Keyword arguments for :func:`md_spa.cluster.analyze_clustering`    
     flag : str, default="python"
-        Choose to calculate via python or cython
+        Choose to calculate via python or cython. If the cython extension is not compiled, the python implementation is used.
 
     """
     
     if not dm.isiterable(boxes):
         raise ValueError("The input `boxes` should be iterable")
 
+    if flag == "cython" and clust is None:
+        warnings.warn("The cython extension, md_spa.cython_modules._clustering, is not compiled. Using flag='python'.")
+        flag = "python"
+
     try:
         tmp_file = target_dir.format(boxes[0])
     except:
         raise ValueError("The given input `target_dir` should have a placeholder {} with which to format the path with entries in `boxes`")
 
     # Check Files
-    remove = []
-    for b in boxes:
-        tmp_path = os.path.join(target_dir.format(b),file_in)
-        if not os.path.isfile(tmp_path):
-            remove.append(b)
-    boxes = [b for b in boxes if b not in remove]
+    boxes = [b for b in boxes if os.path.isfile(os.path.join(target_dir.format(b),file_in))]
 
     # Consolidate data
     tmp_kwargs = {"col_name": column_name, "dtype": int}
@@ -65,27 +68,39 @@ def consolidate(target_dir, boxes, column_name, file_in="coord.lammpstrj", file_
     maxparticles = 0
     for i, box in enumerate(boxes):
         cluster_array = rl.read_lammps_dump( os.path.join(target_dir.format(box),file_in), **tmp_kwargs)[0]
-        n_total = np.array([len(np.where(~np.isnan(x))[0]) for x in cluster_array])
-        n_total_array.append(list(dm.basic_stats(n_total)))
+        missing = np.isnan(cluster_array)
+        n_total_array.append(np.count_nonzero(~missing, axis=1))
         if flag == "python":
-            clust_sizes, nparticles = analyze_clustering(cluster_array, **kwargs_analysis)
+            cid = np.where(missing, 0, cluster_array).astype(np.intp)
+            clust_sizes, nparticles = analyze_clustering(cid, **kwargs_analysis)
         elif flag == "cython":
             ncut = kwargs_analysis["ncut"] if "ncut" in kwargs_analysis else 1
-            clust_sizes, nparticles = clust.analyze_clustering(cluster_array, float(ncut))
+            clust_sizes, nparticles = clust.analyze_clustering(np.asarray(cluster_array, dtype=float), int(ncut))
         else:
             raise ValueError("The flag, {}, is not recognized. Choose: 'python' or 'cython'.".format(flag))
+        clust_sizes = np.asarray(clust_sizes)
         cluster_arrays.append(clust_sizes)
         avg_nparticles.append(np.nanmean(nparticles))
-        tmp = np.array([np.nanmax(x) for x in clust_sizes])
-        largest_cluster.append(list(dm.basic_stats(tmp)))
-        if np.nanmax(clust_sizes) > maxparticles:
-            maxparticles = np.nanmax(clust_sizes)
+        largest_cluster.append(np.nanmax(clust_sizes, axis=1))
+        maxparticles = max(maxparticles, np.nanmax(clust_sizes))
         
-    bins = np.arange(0.5, maxparticles+1.5, 1)
-    output = [bins[:-1]+0.5] + [np.histogram(x.flatten(), bins=bins)[0] for x in cluster_arrays]
+    n_total_array = _box_stats(n_total_array)
+    largest_cluster = _box_stats(largest_cluster)
+
+    # Cluster sizes are integers, so unit width bins centered on 1...maxparticles are a direct count
+    maxparticles = int(maxparticles)
+    hists = [np.bincount(np.nan_to_num(x, nan=0).astype(np.intp).ravel(), minlength=maxparticles+1)[1:maxparticles+1] for x in cluster_arrays]
+    output = [np.arange(1., maxparticles+1)] + hists
     header = ",".join(["#Avg number of nonpercolated beads: {}\n#Average size and standard deviation of largest cluster: {}\n#Average number of beads in frame and std: {}\n#Particles/Cluster".format(avg_nparticles, largest_cluster, n_total_array)]+["Box {}".format(box) for box in boxes])
     fm.write_csv(file_out, np.array(output).T, delimiter=",", header=[header])
 
+def _box_stats(arrays):
+    """ Mean and standard error of each per-frame array in one call to :func:`md_spa.utils.data_manipulation.basic_stats`, boxes with fewer frames are padded with NaN """
+    stacked = np.full((len(arrays), max([len(x) for x in arrays], default=0)), np.nan)
+    for i, tmp in enumerate(arrays):
+        stacked[i, :len(tmp)] = tmp
+    return np.column_stack(dm.basic_stats(stacked, axis=1)).tolist()
+
 def analyze_clustering(cluster_array, ncut=1, show_plot=False):
     """
     Determine the number of non-clustered particles and number of particles in larger clusters.
@@ -96,7 +111,7 @@ def analyze_clustering(cluster_array, ncut=1, show_plot=False):
     Parameters
     ----------
     cluster_array : numpy.ndarray
-        Two dimensional array for each frame containing the cluster numbers assigned to the atoms.
+        Two dimensional array for each frame containing the cluster numbers assigned to the atoms. Cluster numbers start at one, values of NaN or less than one are not counted. An integer array is used directly.
     ncut : int, default=1
         Number of particles in a cluster that is below the percolation limit, such as 6 beads in a hydration shell.
     show_plot : bool, default=False
@@ -114,22 +129,35 @@ def analyze_clustering(cluster_array, ncut=1, show_plot=False):
     if len(np.shape(cluster_array)) != 2:
         raise ValueError("Input array should be 2D")
 
-    nclusters = int(np.nanmax(cluster_array))
-    nparticles = np.zeros(len(cluster_array))
-    cluster_list = []
-    for i,tmp in enumerate(cluster_array):
-        clusters = np.array([np.sum([x==y for x in tmp]) for y in range(1,nclusters+1)])
-        nparticles[i] = np.sum([clusters[x] for x in np.where(np.logical_and(clusters < ncut+1, clusters > 0))[0]])
-        cluster_list.append(clusters[np.where(clusters > ncut)])
-        if show_plot:
-            plt.plot(clusters, label=str(i))
+    # Cluster ids are counted from 1, NaN and non-positive ids are binned into 0 and discarded
+    cluster_array = np.asarray(cluster_array)
+    if np.issubdtype(cluster_array.dtype, np.integer):
+        ca = cluster_array.astype(np.intp, copy=False)
+    else:
+        ca = np.where(np.isnan(cluster_array), 0, cluster_array).astype(np.intp)
+    ca = np.where(ca >= 0, ca, 0)
+    nframes = len(ca)
+    nclusters = int(np.max(ca))
+    counts = np.zeros((nframes, nclusters+1), dtype=np.int64)
+    for i in range(nframes):
+        counts[i] = np.bincount(ca[i], minlength=nclusters+1)
+    counts = counts[:, 1:]
+
+    if ncut == 1:
+        # Common case of isolated particles, each cluster at the threshold holds exactly one
+        nparticles = np.count_nonzero(counts == 1, axis=1).astype(float)
+    else:
+        nparticles = np.sum(np.where(np.logical_and(counts > 0, counts < ncut+1), counts, 0), axis=1).astype(float)
 
-    lx = max([len(x) for x in cluster_list])
-    cluster_output = np.zeros((len(cluster_list), lx))
-    for i, tmp in enumerate(cluster_list):
-        cluster_output[i, :len(tmp)] = tmp
+    # Pack clusters above the threshold to the front of each row, preserving cluster id order
+    mask = counts > ncut
+    lx = np.max(np.sum(mask, axis=1))
+    order = np.argsort(~mask, axis=1, kind="stable")[:, :lx]
+    cluster_output = np.take_along_axis(np.where(mask, counts, 0), order, axis=1).astype(float)
 
     if show_plot:
+        for i, clusters in enumerate(counts):
+            plt.plot(clusters, label=str(i))
         plt.xlabel("Cluster Number")
         plt.ylabel("Number of Particles")
         plt.figure(2)
@@ -177,13 +205,18 @@ def write_vmd(filename, column_name, frame=0, file_xyz="cluster_{}.xyz", file_vm
         raise ValueError("Number of imported frames, {}, is less than request frame number, {}".format(len(cluster_array), frame))
     else:
         cluster_array = cluster_array[frame]
+    xyz = np.ascontiguousarray(cluster_array[:, :3])
+    cid = np.nan_to_num(cluster_array[:, -1], nan=-1).astype(np.intp)
 
-    output = [["X"]+list(x[:3]) for x in cluster_array]
-    header = ["{}\nCluster {}".format(len(cluster_array), frame)]
+    output = [["X"]+list(x) for x in xyz]
+    header = ["{}\nCluster {}".format(len(xyz), frame)]
     fm.write_csv(file_xyz.format(frame), output, delimiter=" ", header=header, header_comment="")
 
-    cluster_ids = list(set(list(cluster_array[:,-1])))
-    clusters = [[i for i,x in enumerate(cluster_array) if x[-1] == y] for y in cluster_ids]
+    order = np.argsort(cid, kind="stable")
+    cluster_ids, starts = np.unique(cid[order], return_index=True)
+    clusters = np.split(order, starts[1:])
+    if len(cluster_ids) > 0 and cluster_ids[0] < 0: # Atoms without a cluster id are not represented
+        cluster_ids, clusters = cluster_ids[1:], clusters[1:]
 
     Cmap = plt.get_cmap(name=cmap)
     colors = Cmap(np.linspace(0, 1, len(cluster_ids)))
@@ -191,7 +224,7 @@ def write_vmd(filename, column_name, frame=0, file_xyz="cluster_{}.xyz", file_vm
         plt.plot([0, 10],[i, i], color=color)
     plt.show()
 
-    lx = np.nanmax(cluster_array[:,:3])
+    lx = np.nanmax(xyz)
     with open(file_vmd.format(frame), "w") as f:
         f.write("# Output clustering visualizaiton created by MD_SPA\n")
         f.write("\n# Background\n")
@@ -208,14 +241,16 @@ def write_vmd(filename, column_name, frame=0, file_xyz="cluster_{}.xyz", file_vm
         f.write('pbc set "{'+"{} {} {}".format(lx,lx,lx)+'}"\n')
         f.write("pbc box -color blue\n")
         f.write("color change rgb 0 0 0 0\n")
+        lines = []
         for i, clust in enumerate(clusters):
-            f.write("\n# Cluster {}\n".format(i))
-            f.write("mol addrep 0\n")
-            f.write("mol modselect {} 0 index {}\n".format(i, " ".join([str(x) for x in clust])))
-            f.write("mol material {} 0 BrushedMetal\n".format(i))
-            f.write("mol modstyle {} 0 VDW 1.000000 12.000000\n".format(i))
-            f.write("color change rgb {} {} {} {}\n".format(i+9, *colors[i][:3]))
-            f.write("mol modcolor {} 0 ColorID {}\n".format(i, i+9))
+            lines.append("\n# Cluster {}\n".format(i))
+            lines.append("mol addrep 0\n")
+            lines.append("mol modselect {} 0 index {}\n".format(i, " ".join(np.char.mod("%d", clust))))
+            lines.append("mol material {} 0 BrushedMetal\n".format(i))
+            lines.append("mol modstyle {} 0 VDW 1.000000 12.000000\n".format(i))
+            lines.append("color change rgb {} {} {} {}\n".format(i+9, *colors[i][:3]))
+            lines.append("mol modcolor {} 0 ColorID {}\n".format(i, i+9))
+        f.write("".join(lines))
         f.write("\n# Render Figure\n")
         f.write("render POV3 {} povray +W%w +H%h -I%s -O%s.png +D +X +A +UA +FN -res {} {} +FT\n".format(file_xyz.split(".")[0].format(frame), npixels, npixels))
 #        f.write("exit\n")
@@ -24,7 +24,7 @@ def periodic2rb(filename, fileout="rb_constants.csv"):
     
     """
 
-    data = np.genfromtxt(filename, dtype=np.float, delimiter=",", missing_values='', filling_values=0.0).T
+    data = np.genfromtxt(filename, dtype=np.float64, delimiter=",", missing_values='', filling_values=0.0).T
     Nconst, Nsets = np.shape(data)
 
     if Nconst not in [3,4]:
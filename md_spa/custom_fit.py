@@ -2401,15 +2401,20 @@ def _res_n_gaussians(params, xarray, yarray, num):
 def _d_n_gaussians(params, xarray, yarray, num):
 
     out = []
+    vary = []
     for n in range(1,num+1):
-        tmp = ( xarray - params["b{}".format(n)] )/params["c{}".format(n)]
-        out.append((np.exp(-np.square(tmp)/2))[np.newaxis,:]) # derivative of a_n 
-        out.append((params["a{}".format(n)]*tmp*np.exp(-np.square(tmp)/2))[np.newaxis,:]) # derivative of b_n
-        out.append((np.square(tmp)/2*np.exp(-np.square(tmp)/2))[np.newaxis,:])
-
-    output = np.concatenate(out, axis=0)
-
-    return np.transpose(np.array(output))
+        a, b, c = params["a{}".format(n)], params["b{}".format(n)], params["c{}".format(n)]
+        tmp = ( xarray - b )/c
+        gauss = np.exp(-np.square(tmp)/2)
+        out.append(gauss[np.newaxis,:]) # derivative of a_n 
+        out.append((a*tmp/c*gauss)[np.newaxis,:]) # derivative of b_n
+        out.append((a*np.square(tmp)/c*gauss)[np.newaxis,:]) # derivative of c_n
+        vary.extend([a.vary, b.vary, c.vary])
+
+    # lmfit expects derivatives with respect to the varying parameters only
+    output = np.concatenate(out, axis=0)[vary]
+
+    return np.transpose(output)
 
 
 def cumulative_exponential(xdata, ydata, minimizer="leastsq", weighting=None, kwargs_minimizer={}, kwargs_parameters={}, verbose=False):
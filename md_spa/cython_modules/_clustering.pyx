@@ -24,7 +24,7 @@ def analyze_clustering(cluster_traj, ncut):
         cdef int nframes_view = nframes
         cdef int natoms_view = natoms
         cdef int nclusters_view = nclusters
-        cdef double ncut_view = ncut
+        cdef int ncut_view = ncut
         cdef int max_clusters
 
         cluster_array = _compile_clusters(
@@ -67,7 +67,7 @@ cdef int[:,:] _compile_clusters(
 cdef int[:] _calc_nparticles(
     int[:,:] clust_array,
     int[:] nparticles,
-    double ncut,
+    int ncut,
     int nframes,
     int nclusters,
 ) nogil:
@@ -86,7 +86,7 @@ cdef int[:] _calc_nparticles(
 cdef int _calc_max_nclusters(
     int[:,:] clust_array,
     int[:] max_array,
-    double ncut,
+    int ncut,
     int nframes,
     int nclusters,
 ) nogil:
@@ -111,7 +111,7 @@ cdef int[:,:] _calc_clusters(
     int[:,:] clust_array,
     int[:,:] cluster_final,
     int[:] indices,
-    double ncut,
+    int ncut,
     int nframes,
     int nclusters,
     int maxclusters,
@@ -0,0 +1,168 @@
+# distutils: language=gcc
+
+import cython
+import numpy as np
+cimport numpy as np
+from libc.math cimport sqrt, log, fabs, INFINITY
+
+def scan_regions(time, msd, min_Npts, skip, dim, min_R2, min_exp, early_exit=False):
+
+        best = np.full(7, np.nan)
+        longest = np.full(7, np.nan)
+        first = np.full(7, np.nan)
+
+        cdef double[:] time_view = np.ascontiguousarray(time, dtype=np.float64)
+        cdef double[:] msd_view = np.ascontiguousarray(msd, dtype=np.float64)
+        cdef double[:] best_view = best
+        cdef double[:] longest_view = longest
+        cdef double[:] first_view = first
+        cdef int npts_view = len(time)
+        cdef int min_npts_view = min_Npts
+        cdef int skip_view = skip
+        cdef double dim_view = dim
+        cdef double min_r2_view = min_R2
+        cdef double min_exp_view = min_exp
+        cdef bint early_exit_view = early_exit
+
+        _scan_regions(
+            time_view, msd_view, best_view, longest_view, first_view, npts_view, min_npts_view, skip_view, dim_view, min_r2_view, min_exp_view, early_exit_view
+        )
+
+        return best, longest
+
+@cython.cdivision(True)
+cdef inline void _linregress(
+    double sx,
+    double sy,
+    double sxx,
+    double syy,
+    double sxy,
+    double n,
+    double* output,
+) noexcept nogil:
+    # Same expressions as md_spa.msd._cumulative_linregress: slope, intercept, stderr, r_squared
+
+    cdef double xmean, ymean, ssxm, ssym, ssxym, r
+
+    xmean = sx/n
+    ymean = sy/n
+    ssxm = sxx/n - xmean*xmean
+    ssym = syy/n - ymean*ymean
+    ssxym = sxy/n - xmean*ymean
+
+    r = ssxym/sqrt(ssxm*ssym)
+    if r > 1.0:
+        r = 1.0
+    elif r < -1.0:
+        r = -1.0
+    output[0] = ssxym/ssxm
+    output[1] = ymean - output[0]*xmean
+    output[2] = sqrt((1 - r*r)*ssym/ssxm/(n - 2))
+    output[3] = r*r
+
+cdef inline bint _less(double a0, double a1, double a2, double b0, double b1, double b2) noexcept nogil:
+    # Lexicographic comparison of (a0, a1, a2) < (b0, b1, b2)
+    if a0 != b0:
+        return a0 < b0
+    if a1 != b1:
+        return a1 < b1
+    return a2 < b2
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _scan_regions(
+    double[:] time,
+    double[:] msd,
+    double[:] best,
+    double[:] longest,
+    double[:] first,
+    int npts,
+    int min_npts,
+    int skip,
+    double dim,
+    double min_r2,
+    double min_exp,
+    bint early_exit,
+) noexcept nogil:
+
+    cdef int i, j, k, nregion
+    cdef int drift = 0
+    cdef double x, y, lx, ly, err, start_err
+    cdef double sx, sy, sxx, syy, sxy, lsx, lsy, lsxx, lsyy, lsxy
+    cdef double lin[4]
+    cdef double logs[4]
+    cdef double region[7]
+    cdef double best_err = INFINITY, best_n = INFINITY, best_i = INFINITY
+    cdef double first_n = INFINITY, first_i = INFINITY, first_err = INFINITY
+    cdef double longest_n = INFINITY, longest_err = INFINITY, longest_i = INFINITY
+
+    i = 0
+    while i < npts - min_npts and drift < 3:
+        sx = 0; sy = 0; sxx = 0; syy = 0; sxy = 0
+        lsx = 0; lsy = 0; lsxx = 0; lsyy = 0; lsxy = 0
+        nregion = min_npts
+        start_err = INFINITY
+        for j in range(npts - i - 1):
+            # Running sums of the region shifted by its first point
+            x = time[i+j] - time[i]
+            y = msd[i+j] - msd[i]
+            sx = sx + x
+            sy = sy + y
+            sxx = sxx + x*x
+            syy = syy + y*y
+            sxy = sxy + x*y
+            if j > 0:
+                lx = log(x)
+                ly = log(y)
+                lsx = lsx + lx
+                lsy = lsy + ly
+                lsxx = lsxx + lx*lx
+                lsyy = lsyy + ly*ly
+                lsxy = lsxy + lx*ly
+            if j + 1 != nregion:
+                continue
+            nregion = nregion + skip
+
+            _linregress(lsx, lsy, lsxx, lsyy, lsxy, j, logs)
+            if not logs[3] > min_r2:
+                continue
+            _linregress(sx, sy, sxx, syy, sxy, j + 1, lin)
+            region[0] = lin[0]/2/dim
+            region[1] = lin[2]/2/dim
+            region[2] = time[i]
+            region[3] = time[i+j]
+            region[4] = logs[0]
+            region[5] = lin[1] + (msd[i] - lin[0]*time[i])
+            region[6] = j + 1
+            err = fabs(logs[0] - 1.0)
+            if err < start_err:
+                start_err = err
+
+            if _less(err, j + 1, i, best_err, best_n, best_i):
+                best_err, best_n, best_i = err, j + 1, i
+                for k in range(7):
+                    best[k] = region[k]
+
+            if _less(j + 1, i, 0, first_n, first_i, 0):
+                first_n, first_i, first_err = j + 1, i, err
+                for k in range(7):
+                    first[k] = region[k]
+
+            if logs[0] >= min_exp and _less(-(j + 1), err, i, longest_n, longest_err, longest_i):
+                longest_n, longest_err, longest_i = -(j + 1), err, i
+                for k in range(7):
+                    longest[k] = region[k]
+
+        # Count consecutive starting points without a region near the best exponent
+        if early_exit:
+            if start_err > 3*best_err:
+                drift = drift + 1
+            else:
+                drift = 0
+        i = i + skip
+
+    # The first acceptable region is kept as the longest region until one with an exponent of at least min_exp replaces it
+    if first_n != INFINITY and not _less(longest_n, longest_err, longest_i, -first_n, first_err, first_i):
+        for k in range(7):
+            longest[k] = first[k]
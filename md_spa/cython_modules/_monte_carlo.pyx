@@ -0,0 +1,60 @@
+# distutils: language=gcc
+
+import cython
+from cython.parallel import prange
+import numpy as np
+cimport numpy as np
+
+def in_volume(test_pts, ref_pts, rcut2):
+
+        if test_pts.shape[1] != ref_pts.shape[1]:
+            raise ValueError("The number of dimensions in `test_pts` does not equal that of `ref_pts`")
+        if ref_pts.shape[0] != rcut2.shape[0]:
+            raise ValueError("The number of reference points in `ref_pts` does not equal the number of entries in `rcut2`")
+
+        npts, ndims = np.shape(test_pts)
+        nrefs = ref_pts.shape[0]
+        in_vol = np.zeros(npts, dtype=np.int32)
+
+        cdef float[:,:] test_view = np.ascontiguousarray(test_pts, dtype=np.float32)
+        cdef float[:,:] ref_view = np.ascontiguousarray(ref_pts, dtype=np.float32)
+        cdef float[:] rcut2_view = np.ascontiguousarray(rcut2, dtype=np.float32)
+        cdef int[:] in_vol_view = in_vol
+        cdef int npts_view = npts
+        cdef int nrefs_view = nrefs
+        cdef int ndims_view = ndims
+
+        in_vol = _in_volume(
+            test_view, ref_view, rcut2_view, in_vol_view, npts_view, nrefs_view, ndims_view
+        )
+
+        return np.asarray(in_vol).astype(bool)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef int[:] _in_volume(
+    float[:,:] test_pts,
+    float[:,:] ref_pts,
+    float[:] rcut2,
+    int[:] in_vol,
+    int npts,
+    int nrefs,
+    int ndims,
+) nogil:
+
+    cdef int i, j, k
+    cdef float dr, dist2
+
+    for i in prange(npts, nogil=True):
+        for j in range(nrefs):
+            dist2 = 0
+            for k in range(ndims):
+                dr = test_pts[i][k] - ref_pts[j][k]
+                dist2 = dist2 + dr*dr
+            if dist2 <= rcut2[j]:
+                # Stop at the first sphere that contains this point
+                in_vol[i] = 1
+                break
+
+    return in_vol
@@ -5,13 +5,12 @@
 
 """
 import copy
+import functools
 import numpy as np
-import matplotlib.pyplot as plt
 
-from scipy.interpolate import InterpolatedUnivariateSpline
+from scipy.interpolate import InterpolatedUnivariateSpline, PPoly, make_interp_spline
 from scipy.ndimage import gaussian_filter1d
 
-import misc_modules.custom_plotting as cplot
 import md_spa.custom_fit as cfit
 
 def extract_gaussians(xdata, ydata, n_gaussians=None, normalize=False, kwargs_peaks={}, kwargs_fit={}, show_plot=False, save_plot=False, plot_name="n_gaussians.png"):
@@ -51,55 +50,39 @@ def extract_gaussians(xdata, ydata, n_gaussians=None, normalize=False, kwargs_pe
     """
 
     if n_gaussians is None:
-        _, maxima, _ = cplot.pull_extrema(xdata, ydata, **kwargs_peaks)
+        _, maxima, _ = pull_extrema(xdata, ydata, **kwargs_peaks)
+        maxima = maxima.T
         n_gaussians = len(maxima)
-        min_height = np.min(maxima.T[1])
-        max_height = np.max(maxima.T[1])
-        for i,max_pt in enumerate(maxima):
-            if "kwargs_parameters" not in kwargs_fit:
-                kwargs_fit["kwargs_parameters"] = {}
-            kwargs_fit["kwargs_parameters"]["b{}".format(i+1)] = {"value": max_pt[0], "max": np.max(xdata), "min": np.min(xdata), "vary": False}
-            kwargs_fit["kwargs_parameters"]["a{}".format(i+1)] = {"value": max_pt[1], "max": max_height, "min": min_height}
-            kwargs_fit["kwargs_parameters"]["c{}".format(i+1)] = {"value": max_pt[0]/10}
-    else:
-        maxima = None
+        kwargs_fit = copy.deepcopy(kwargs_fit)
+        kwargs_parameters = kwargs_fit.setdefault("kwargs_parameters", {})
+        kwargs_parameters.update(_make_gauss_params(maxima, xdata, np.min(maxima[:,1]), np.max(maxima[:,1])))
 
-    if n_gaussians is None:
-        # Fit parameters to set peak locations
-        parameters, uncertainty, redchi = cfit.n_gaussians(xdata, ydata, len(maxima), **kwargs_fit)
-        parameters = np.reshape(parameters, (len(maxima), 3))
+        # Fit parameters to set peak locations, custom_fit.n_gaussians removes the entries of kwargs_parameters it uses
+        parameters, uncertainty, redchi = cfit.n_gaussians(xdata, ydata, n_gaussians, **copy.deepcopy(kwargs_fit))
+        parameters = np.reshape(parameters, (n_gaussians, 3))
         # Fit parameters with all free peak locations
-        for n, (a,b,c) in enumerate(parameters):
-            del kwargs_fit["kwargs_parameters"]["a{}".format(i+1)]["vary"]
-            kwargs_fit["kwargs_parameters"]["b{}".format(i+1)]["value"] = b
-            kwargs_fit["kwargs_parameters"]["c{}".format(i+1)]["value"] = c
+        for (_, b_key, c_key), (a, b, c) in zip(_param_keys(n_gaussians), parameters):
+            kwargs_parameters[b_key].update({"value": b, "vary": True})
+            kwargs_parameters[c_key]["value"] = c
+    else:
+        maxima = None
 
-    n_gaussians = len(maxima)    
-    parameters, uncertainty, redchi = cfit.n_gaussians(xdata, ydata, n_gaussians, **kwargs_fit)
+    parameters, uncertainty, redchi = cfit.n_gaussians(xdata, ydata, n_gaussians, **copy.deepcopy(kwargs_fit))
     parameters = np.reshape(parameters, (n_gaussians, 3))
     uncertainties = np.reshape(uncertainty, (n_gaussians, 3))
 
     if normalize:
-        integral = 0
-        for n in range(n_gaussians):
-            integral += parameters[n][0]*parameters[n][2]*np.sqrt(2*np.pi)
-        tmp = np.transpose(parameters)
-        tmp[0] /= integral
-        parameters = np.transpose(tmp)
-        tmp = np.transpose(uncertainties)
-        tmp[0] /= integral
-        uncertainties = np.transpose(tmp)
-        ydata /= integral
+        integral = np.sqrt(2*np.pi)*np.sum(parameters[:,0]*parameters[:,2])
+        parameters[:,0] /= integral
+        uncertainties[:,0] /= integral
+        ydata = ydata/integral
 
     if show_plot or save_plot:
+        import matplotlib.pyplot as plt
         plt.plot(xdata,ydata,"k",label="Data")
         xarray2 = np.linspace(xdata[0],xdata[-1],int(1e+4))
-        params = {}
-        for i, (a,b,c) in enumerate(parameters):
-            params["a{}".format(i+1)] = a
-            params["b{}".format(i+1)] = b
-            params["c{}".format(i+1)] = c
-        yarray2 = cfit._res_n_gaussians(params, xarray2, np.zeros(len(xarray2)), n_gaussians)
+        a, b, c = parameters[:,0][:,None], parameters[:,1][:,None], parameters[:,2][:,None]
+        yarray2 = np.sum(a*np.exp(-(xarray2[None,:]-b)**2/(2*c**2)), axis=0)
         plt.plot(xarray2,yarray2,"r",linewidth=0.5,label="Fit")
         if np.all(maxima is not None):
             for i in range(len(maxima)):
@@ -114,6 +97,22 @@ def extract_gaussians(xdata, ydata, n_gaussians=None, normalize=False, kwargs_pe
 
     return parameters, uncertainties, redchi
 
+@functools.lru_cache(maxsize=None)
+def _param_keys(n_gaussians):
+    """ Tuple of ("a{n}", "b{n}", "c{n}") parameter names for each gaussian in :func:`md_spa.custom_fit.n_gaussians` """
+    return tuple(("a{}".format(n), "b{}".format(n), "c{}".format(n)) for n in range(1, n_gaussians+1))
+
+def _make_gauss_params(maxima, xdata, min_height, max_height):
+    """ Initial ``kwargs_parameters`` for :func:`md_spa.custom_fit.n_gaussians` with peak locations fixed at ``maxima`` """
+    xmin, xmax = np.min(xdata), np.max(xdata)
+    kwargs_parameters = {}
+    for (a_key, b_key, c_key), (x, y) in zip(_param_keys(len(maxima)), maxima):
+        kwargs_parameters[b_key] = {"value": x, "max": xmax, "min": xmin, "vary": False}
+        kwargs_parameters[a_key] = {"value": y, "max": max_height, "min": min_height}
+        kwargs_parameters[c_key] = {"value": x/10}
+
+    return kwargs_parameters
+
 def pull_extrema( xarray, yarray, sigma_spline=None, sigma_ddspline=None, error_length=25, extrema_cutoff=0.0, show_plot=False, save_plot=False, plot_name="extrema.png"):
     """
     Pull minima, maxima, and inflection points from x-y data.
@@ -175,12 +174,19 @@ def pull_extrema( xarray, yarray, sigma_spline=None, sigma_ddspline=None, error_
         yarray0 = None
     ######
 
-    spline = InterpolatedUnivariateSpline(xarray,yarray, k=4)
-    extrema = spline.derivative().roots().tolist()
-    extrema = [x for x in extrema if np.abs(spline(x))>extrema_cutoff]
+    # One quintic interpolating spline provides both derivatives, which are converted to piecewise polynomials for their roots
+    spline = make_interp_spline(xarray, yarray, k=5)
+    dspline = spline.derivative()
+    spline_concavity = spline.derivative(2)
+    extrema = PPoly.from_spline(dspline).roots(extrapolate=False)
+    extrema = np.unique(extrema[np.isfinite(extrema)])
+    extrema_values = spline(extrema)
+    mask = np.abs(extrema_values) > extrema_cutoff
+    extrema, extrema_values = extrema[mask], extrema_values[mask]
 
     if len(extrema) > error_length:
         if show_plot:
+            import matplotlib.pyplot as plt
             plt.plot(xarray,yarray,"k",label="Data")
             plt.plot([xarray[0],xarray[-1]],[1,1],"k",linewidth=0.5)
             plt.plot([xarray[0],xarray[-1]],[0,0],"k",linewidth=0.5)
@@ -191,32 +197,25 @@ def pull_extrema( xarray, yarray, sigma_spline=None, sigma_ddspline=None, error_
             plt.plot(r2,gr2,"r",label="Spline",linewidth=0.5)
             plt.show()
         raise ValueError("Found {} extrema, consider smoothing the data with `sigma_spline` option.".format(len(extrema)))
-    tmp_spline = spline.derivative().derivative()
-    concavity = tmp_spline(extrema)
-
-    maxima = []
-    minima = []
-    for i,rtmp in enumerate(extrema):
-        if concavity[i] > 0:
-            minima.append([rtmp, spline(rtmp)])
-        else:
-            maxima.append([rtmp, spline(rtmp)])
+    is_minimum = spline_concavity(extrema) > 0
+    minima = np.array([extrema[is_minimum], extrema_values[is_minimum]])
+    maxima = np.array([extrema[~is_minimum], extrema_values[~is_minimum]])
 
-    inflections = []
-    spline_concavity = InterpolatedUnivariateSpline(xarray,yarray, k=5).derivative().derivative()
-    tmp_inflections = spline_concavity.roots().tolist()
+    tmp_inflections = PPoly.from_spline(spline_concavity).roots(extrapolate=False)
+    tmp_inflections = np.unique(tmp_inflections[np.isfinite(tmp_inflections)])
     if sigma_ddspline is not None:
         spline_concavity_smooth = InterpolatedUnivariateSpline( 
             xarray, 
             gaussian_filter1d(spline_concavity(xarray), sigma=sigma_ddspline), 
             k=3,
         )
-        tmp_inflections = spline_concavity_smooth.roots().tolist()
-    tmp_inflections = [x for x in tmp_inflections if np.abs(spline(x))>extrema_cutoff]
-    for rtmp in tmp_inflections:
-        inflections.append([rtmp, spline(rtmp)])
+        tmp_inflections = spline_concavity_smooth.roots()
+    inflection_values = spline(tmp_inflections)
+    mask = np.abs(inflection_values) > extrema_cutoff
+    inflections = np.array([tmp_inflections[mask], inflection_values[mask]])
 
     if show_plot or save_plot:
+        import matplotlib.pyplot as plt
         xarray2 = np.linspace(xarray[0],xarray[-1],int(1e+4))
         yarray2 = spline(xarray2)
         if sigma_ddspline is not None:
@@ -227,13 +226,13 @@ def pull_extrema( xarray, yarray, sigma_spline=None, sigma_ddspline=None, error_
             else:
                 axs[0].plot( xarray, yarray0, "k", linewidth=0.5, label="Data")
             axs[0].plot( xarray2, yarray2, "r", linewidth=0.5, linestyle="--", label="Spline")
-            for i in range(len(maxima)):
-                axs[0].plot([maxima[i][0],maxima[i][0]],[min(yarray),max(yarray)],"c",linewidth=0.5)
-            for i in range(len(minima)):
-                axs[0].plot([minima[i][0],minima[i][0]],[min(yarray),max(yarray)],"b",linewidth=0.5)
-            for i in range(len(inflections)):
-                axs[0].plot([inflections[i][0],inflections[i][0]],[min(yarray),max(yarray)],"r",linewidth=0.5)
-                axs[1].plot([inflections[i][0],inflections[i][0]],[min(ddtmp),max(ddtmp)],"r",linewidth=0.5)
+            for tmp in maxima[0]:
+                axs[0].plot([tmp,tmp],[min(yarray),max(yarray)],"c",linewidth=0.5)
+            for tmp in minima[0]:
+                axs[0].plot([tmp,tmp],[min(yarray),max(yarray)],"b",linewidth=0.5)
+            for tmp in inflections[0]:
+                axs[0].plot([tmp,tmp],[min(yarray),max(yarray)],"r",linewidth=0.5)
+                axs[1].plot([tmp,tmp],[min(ddtmp),max(ddtmp)],"r",linewidth=0.5)
             axs[0].set_xlim( xarray[0], xarray[-1])
             axs[0].set_title("Data and Spline")
             axs[1].plot(xarray, ddtmp, "r", linewidth=0.5, label="Spline")
@@ -247,12 +246,12 @@ def pull_extrema( xarray, yarray, sigma_spline=None, sigma_ddspline=None, error_
             else:
                 plt.plot(xarray,yarray0,"k",linewidth=0.5, label="Data")
             plt.plot(xarray2,yarray2,"r",linewidth=0.5,label="Spline")
-            for i in range(len(maxima)):
-                plt.plot([maxima[i][0],maxima[i][0]],[min(yarray),max(yarray)],"c",linewidth=0.5)
-            for i in range(len(minima)):
-                plt.plot([minima[i][0],minima[i][0]],[min(yarray),max(yarray)],"b",linewidth=0.5)
-#            for i in range(len(inflections)):
-#                plt.plot([inflections[i][0],inflections[i][0]],[min(yarray),max(yarray)],"r",linewidth=0.5)
+            for tmp in maxima[0]:
+                plt.plot([tmp,tmp],[min(yarray),max(yarray)],"c",linewidth=0.5)
+            for tmp in minima[0]:
+                plt.plot([tmp,tmp],[min(yarray),max(yarray)],"b",linewidth=0.5)
+#            for tmp in inflections[0]:
+#                plt.plot([tmp,tmp],[min(yarray),max(yarray)],"r",linewidth=0.5)
         plt.xlim(xarray[0],xarray[-1])
         plt.tight_layout()
         if save_plot:
@@ -261,5 +260,5 @@ def pull_extrema( xarray, yarray, sigma_spline=None, sigma_ddspline=None, error_
             plt.show()
         plt.close()
 
-    return np.array(minima).T, np.array(maxima).T, np.array(inflections).T
+    return minima, maxima, inflections
 
@@ -314,7 +314,7 @@ def calc_msds(u, groups, dt=None, verbose=False, fft=False, run_kwargs={}):
             try:
                 nongaussian_parameter[i+1,:MSD.n_frames] = MSD.results.nongaussian_parameter
             except:
-                warning.warn("Sorry, the ability to calculate the nongaussian_parameter has not yet been contributed to MDAnalysis.")
+                warnings.warn("Sorry, the ability to calculate the nongaussian_parameter has not yet been contributed to MDAnalysis.")
                 nongaussian_parameter = None
 
     if not fft:
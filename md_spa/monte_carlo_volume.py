@@ -5,15 +5,20 @@
 
 """
 
+import warnings
 import numpy as np
 
+try:
+    from md_spa.cython_modules import _monte_carlo as mc
+except ImportError:
+    mc = None
 from md_spa.utils import data_manipulation as dm
 
-def random_points(npts, ranges):
+def random_points(npts, ranges, seed=None, dtype=np.float64):
     """
     Random points for Monte Carlo use.
 
-    Using `numpy.random.uniform <https://numpy.org/doc/stable/reference/random/generated/numpy.random.uniform.html>`_, ``npts`` vectors are generated of length ``len(ranges)``.
+    Using `numpy.random.Generator.random <https://numpy.org/doc/stable/reference/random/generated/numpy.random.Generator.random.html>`_, ``npts`` vectors are generated of length ``len(ranges)``.
     The iterable, ranges contains iterables of length 2 with the minimum and maximum of that point.
 
     An example of this might be ``npts=1e+3`` with a 3x4x2 box, ``ranges=[[0,3],[0,4],[0,2]]``
@@ -24,6 +29,10 @@ def random_points(npts, ranges):
         Number of vector "points" to produce
     ranges : list[list]
         Iterable of min and max values for each dimension of the vectors
+    seed : int, default=None
+        Seed for `numpy.random.default_rng <https://numpy.org/doc/stable/reference/random/generator.html#numpy.random.default_rng>`_, if None a fresh seed is drawn from the OS.
+    dtype : numpy.dtype, default=numpy.float64
+        Floating point type of the output, either ``numpy.float64`` or ``numpy.float32``
 
     Returns
     -------
@@ -32,13 +41,14 @@ def random_points(npts, ranges):
 
     """
 
-    np.random.seed()
-    output = np.zeros((int(npts),len(ranges)))
-    for i,(xmin, xmax) in enumerate(ranges):
-        output[:,i] = np.random.uniform( xmin, xmax, int(npts))
+    ranges = np.asarray(ranges, dtype=dtype)
+    rng = np.random.default_rng(seed)
+    output = rng.random((int(npts), len(ranges)), dtype=dtype)
+    output *= ranges[:,1]-ranges[:,0]
+    output += ranges[:,0]
     return output
 
-def overlapping_spheres(rcut, ref_pts, npts=1e+4, repeats=3):
+def overlapping_spheres(rcut, ref_pts, npts=1e+4, repeats=3, flag="python", seed=None):
     """
     Monte Carlo code to determine the volume of several overlapping spheres
 
@@ -49,9 +59,13 @@ def overlapping_spheres(rcut, ref_pts, npts=1e+4, repeats=3):
     ref_pts : numpy.ndarray
         Array of reference points for centers of circles    
     npts : int, default=1e+4
-        Number of vector "points" to produce. 
+        Number of vector "points" to produce. If None, ten points per cubic unit of the bounding box are used.
     repeats : int, default=3
-        Number of times this MC calculation is performed to obtain the standard deviation
+        Number of times this MC calculation is performed to obtain the standard deviation. The points for all repeats are drawn and tested together, then split to evaluate the volume of each repeat.
+    flag : str, default="python"
+        Choose 'python' implementation or accelerated 'cython' option. The cython option stops checking a point at the first sphere that contains it. If the cython extension is not compiled, the python implementation is used.
+    seed : int, default=None
+        Seed for :func:`md_spa.monte_carlo_volume.random_points` to reproduce the test points
 
     Returns
     -------
@@ -61,7 +75,6 @@ def overlapping_spheres(rcut, ref_pts, npts=1e+4, repeats=3):
         The standard deviation based on the number of times this calculation was repeated
 
     """
-    npts = int(npts)
     repeats = int(repeats)
 
     if not dm.isiterable(rcut):
@@ -70,19 +83,43 @@ def overlapping_spheres(rcut, ref_pts, npts=1e+4, repeats=3):
         raise ValueError("Length of rcut (circle radii) and number of reference points (circle centers) must be equal")
 
     nrefs = len(ref_pts)
-    ref_pts = np.array(ref_pts)
+    rcut = np.asarray(rcut, dtype=float)
+    ref_pts = np.array(ref_pts, dtype=float)
     ref_pts -= np.mean(ref_pts, axis=0)
-    ranges = [[np.min(x)-rcut[i], np.max(x)+rcut[i]] for i,x in enumerate(ref_pts.T)]
+    # Bounding box of all spheres
+    ranges = np.stack((np.min(ref_pts-rcut[:, None], axis=0), np.max(ref_pts+rcut[:, None], axis=0)), axis=1)
 
-    volume = np.prod(np.array([xmax-xmin for (xmin,xmax) in ranges]))
-    if npts == None:
+    volume = np.prod(ranges[:,1]-ranges[:,0])
+    if npts is None:
         npts = int(volume)*10
+    npts = int(npts)
 
-    test_points = np.reshape(random_points(repeats*npts, ranges), (repeats, npts, 3))
-    distances = np.sum(np.square(test_points[:,:,None,:] - ref_pts[None, None, :, :]), axis=-1)
-    in_vol_count = np.sum(distances <= np.square(rcut)[None, None, :], axis=-1) # Sum over ref points
-    in_vol = in_vol_count > 0 # Bool, in volume or out?
-    vol_repeats = np.sum(in_vol, axis=-1)/npts*volume
+    if flag == "cython" and mc is None:
+        warnings.warn("The cython extension, md_spa.cython_modules._monte_carlo, is not compiled. Using flag='python'.")
+        flag = "python"
+
+    # Single precision is sufficient to test a point against a sphere and halves memory traffic
+    rcut2 = np.square(rcut).astype(np.float32)
+    ref_pts = ref_pts.astype(np.float32)
+    test_points = random_points(repeats*npts, ranges, seed=seed, dtype=np.float32)
+    if flag == "python":
+        in_vol = np.zeros(repeats*npts, dtype=bool) # Bool, in volume or out?
+        # Tile test and reference points so each block of distances stays in cache
+        tile_pts, tile_refs = 512, 64
+        for t0 in range(0, repeats*npts, tile_pts):
+            pts = test_points[t0:t0+tile_pts]
+            hit = in_vol[t0:t0+tile_pts]
+            for r0 in range(0, nrefs, tile_refs):
+                diff = pts[:, None, :] - ref_pts[None, r0:r0+tile_refs, :]
+                distances = np.einsum("ijk,ijk->ij", diff, diff)
+                np.logical_or(hit, np.any(distances <= rcut2[None, r0:r0+tile_refs], axis=1), out=hit) # Any ref point
+                if np.all(hit):
+                    break
+    elif flag == "cython":
+        in_vol = mc.in_volume(test_points, ref_pts, rcut2)
+    else:
+        raise ValueError("The flag, {}, is not recognized. Choose: 'python' or 'cython'.".format(flag))
+    vol_repeats = np.sum(np.reshape(in_vol, (repeats, npts)), axis=1, dtype=np.int64)/npts*volume
     final_stats = dm.basic_stats(vol_repeats, error_descriptor="sample")
 
     return final_stats[0], final_stats[1]
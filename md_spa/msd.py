@@ -6,19 +6,25 @@
 """
 
 import re
+import functools
 import numpy as np
 import warnings
 import os
-import matplotlib.pyplot as plt
-from scipy.stats import linregress
+from concurrent.futures import ProcessPoolExecutor
 from scipy.interpolate import InterpolatedUnivariateSpline
 from scipy.ndimage import gaussian_filter1d
 
+try:
+    from md_spa.cython_modules import _diffusivity as cdiff
+except ImportError:
+    cdiff = None
 from md_spa.utils import data_manipulation as dm
 from md_spa.utils import file_manipulation as fm
-from md_spa import fit_data as fd
 
-def keypoints2csv(filename, fileout="msd.csv", mode="a", delimiter=",", titles=None, additional_entries=None, additional_header=None, kwargs_find_diffusivity={}, kwargs_debye_waller={}, file_header_kwargs={}):
+# Column titles end before units given in brackets or parentheses
+_HEADER_SPLIT = re.compile(r"[,\[\(]")
+
+def keypoints2csv(filename, fileout="msd.csv", mode="a", delimiter=",", titles=None, additional_entries=None, additional_header=None, kwargs_find_diffusivity={}, kwargs_debye_waller={}, file_header_kwargs={}, ncores=1):
     """
     Given the path to a csv file containing msd data, extract key values and save them to a .csv file. The file of msd data should have a first column with distance values, followed by columns with radial distribution values. These data sets will be distinguished in the resulting csv file with the column headers
 
@@ -44,6 +50,8 @@ def keypoints2csv(filename, fileout="msd.csv", mode="a", delimiter=",", titles=N
         Keywords for :func:`md_spa.msd.debye_waller` function
     file_header_kwargs : dict, default={}
         Keywords for :func:`md_spa.utils.os_manipulation.file_header` function    
+    ncores : int, default=1
+        Number of processes used to analyze the msd columns in parallel. Plots should be saved rather than shown when more than one is used.
 
     Returns
     -------
@@ -53,21 +61,21 @@ def keypoints2csv(filename, fileout="msd.csv", mode="a", delimiter=",", titles=N
     if not os.path.isfile(filename):
         raise ValueError("The given file could not be found: {}".format(filename))
 
-    data = np.transpose(np.genfromtxt(filename, delimiter=delimiter))
+    data = _read_columns(filename, delimiter=delimiter)
 
-    if titles == None:
-        titles = [re.split(",|\[|\(", x)[0] for x in fm.find_header(filename, **file_header_kwargs)]
+    if titles is None:
+        titles = [_HEADER_SPLIT.split(x, maxsplit=1)[0] for x in fm.find_header(filename, **file_header_kwargs)]
     if len(titles) != len(data):
         raise ValueError("The number of titles does not equal the number of columns")
 
-    if np.all(additional_entries != None):
+    if additional_entries is not None:
         flag_add_ent = True
         if not dm.isiterable(additional_entries):
             raise ValueError("The provided variable `additional_entries` must be iterable")
     else:
         flag_add_ent = False
         additional_entries = []
-    if np.all(additional_header != None):
+    if additional_header is not None:
         flag_add_header = True
         if not dm.isiterable(additional_header):
             raise ValueError("The provided variable `additional_header` must be iterable")
@@ -82,32 +90,45 @@ def keypoints2csv(filename, fileout="msd.csv", mode="a", delimiter=",", titles=N
             additional_header = ["-" for x in additional_entries]
             flag_add_header = True
 
-    t_tmp = data[0]
-    tmp_data = []
-    for i in range(1,len(data)):
-        tmp_kwargs_diff = kwargs_find_diffusivity.copy()
-        tmp_kwargs_dw = kwargs_debye_waller.copy()
-        if "title" not in tmp_kwargs_diff:
-            tmp_kwargs_diff["title"] = titles[i]
-        if "title" not in tmp_kwargs_dw:
-            tmp_kwargs_dw["title"] = titles[i]
-        dw, tau = debye_waller(t_tmp, data[i], **tmp_kwargs_dw)
-        if ("bounds" not in tmp_kwargs_diff or (tmp_kwargs_diff["bounds"][0] is not None or np.isnan(tmp_kwargs_diff["bounds"][0]))) and not np.isnan(tau):
-            if "bounds" not in tmp_kwargs_diff:
-                tmp_kwargs_diff["bounds"] = (10*tau, None)
-            else:
-                tmp_kwargs_diff["bounds"] = (10*tau, tmp_kwargs_diff["bounds"][1])
-        best, longest = find_diffusivity(t_tmp, data[i], **tmp_kwargs_diff)
-        tmp_data.append(list(additional_entries)+[titles[i]]+[dw, tau]+list(best)+list(longest))
-
     file_headers = ["Group", "DW [l-unit^2]", "tau [t-unit]", "Best D [l-unit^2 / t-unit]", "B D SE", "B t_bound1 [t-unit]", "B t_bound2 [t-unit]", "B Exponent", "B Intercept [l-unit^2]", "B Npts", "Longest D [l-unit^2/t-unit]", "L D SE", "L t_bound1 [t-unit]", "L t_bound2 [t-unit]", "L Exponent", "L Intercept [l-unit^2]", "L Npts"]
-    if not os.path.isfile(fileout) or mode=="w":
-        if flag_add_header:
-            file_headers = list(additional_header) + file_headers
-        fm.write_csv(fileout, tmp_data, mode=mode, header=file_headers)
-    else:
-        fm.write_csv(fileout, tmp_data, mode=mode)
+    if flag_add_header:
+        file_headers = list(additional_header) + file_headers
 
+    t_tmp = data[0]
+    args = [(t_tmp, data[i], titles[i], kwargs_debye_waller, kwargs_find_diffusivity) for i in range(1,len(data))]
+    executor = ProcessPoolExecutor(max_workers=ncores) if ncores > 1 else None
+    try:
+        if executor is not None:
+            keypoints = executor.map(_column_keypoints, *zip(*args))
+        else:
+            keypoints = (_column_keypoints(*x) for x in args)
+        # Each row is written once its column is analyzed, so completed results are kept if a later column fails
+        # The header is only written when the file is created or overwritten
+        for i, x in enumerate(keypoints):
+            fm.write_csv(fileout, [list(additional_entries)+[titles[i+1]]+x], mode=mode if i == 0 else "a", header=file_headers)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def _column_keypoints(time, msd, title, kwargs_debye_waller, kwargs_find_diffusivity):
+    """ Debye-Waller factor and diffusivity of one msd column for :func:`md_spa.msd.keypoints2csv`, returned as a list of ``[dw, tau] + best + longest`` """
+
+    tmp_kwargs_diff = kwargs_find_diffusivity.copy()
+    tmp_kwargs_dw = kwargs_debye_waller.copy()
+    if "title" not in tmp_kwargs_diff:
+        tmp_kwargs_diff["title"] = title
+    if "title" not in tmp_kwargs_dw:
+        tmp_kwargs_dw["title"] = title
+    dw, tau = debye_waller(time, msd, **tmp_kwargs_dw)
+    if ("bounds" not in tmp_kwargs_diff or (tmp_kwargs_diff["bounds"][0] is not None or np.isnan(tmp_kwargs_diff["bounds"][0]))) and not np.isnan(tau):
+        if "bounds" not in tmp_kwargs_diff:
+            tmp_kwargs_diff["bounds"] = (10*tau, None)
+        else:
+            tmp_kwargs_diff["bounds"] = (10*tau, tmp_kwargs_diff["bounds"][1])
+    best, longest = find_diffusivity(time, msd, **tmp_kwargs_diff)
+
+    return [dw, tau]+list(best)+list(longest)
 
 def nongaussian2csv(filename, fileout="nongaussian.csv", mode="a", delimiter=",", titles=None, additional_entries=None, additional_header=None, file_header_kwargs={}, kwargs_extrema={}):
     """
@@ -143,21 +164,21 @@ def nongaussian2csv(filename, fileout="nongaussian.csv", mode="a", delimiter=","
     if not os.path.isfile(filename):
         raise ValueError("The given file could not be found: {}".format(filename))
 
-    data = np.transpose(np.genfromtxt(filename, delimiter=delimiter, comments="#"))
+    data = _read_columns(filename, delimiter=delimiter)
 
-    if titles == None:
-        titles = [re.split(",|\[|\(", x)[0] for x in fm.find_header(filename, **file_header_kwargs)]
+    if titles is None:
+        titles = [_HEADER_SPLIT.split(x, maxsplit=1)[0] for x in fm.find_header(filename, **file_header_kwargs)]
     if len(titles) != len(data):
         raise ValueError("The number of titles does not equal the number of columns")
 
-    if np.all(additional_entries != None):
+    if additional_entries is not None:
         flag_add_ent = True
         if not dm.isiterable(additional_entries):
             raise ValueError("The provided variable `additional_entries` must be iterable")
     else:
         flag_add_ent = False
         additional_entries = []
-    if np.all(additional_header != None):
+    if additional_header is not None:
         flag_add_header = True
         if not dm.isiterable(additional_header):
             raise ValueError("The provided variable `additional_header` must be iterable")
@@ -172,29 +193,46 @@ def nongaussian2csv(filename, fileout="nongaussian.csv", mode="a", delimiter=","
             additional_header = ["-" for x in additional_entries]
             flag_add_header = True
 
+    file_headers = ["Group", "tau", "nongauss peak"]
+    if flag_add_header:
+        file_headers = list(additional_header) + file_headers
+
+    # fit_data imports lmfit, which brings in pandas, so it is only loaded for this function
+    from md_spa import fit_data as fd
     t_tmp = np.log10(data[0][1:])
-    tmp_data = []
     for i in range(1,len(data)):
         kwargs_tmp = kwargs_extrema.copy()
         tmp = os.path.split(kwargs_tmp["plot_name"])
         kwargs_tmp["plot_name"] = os.path.join(tmp[0],titles[i].replace(" ", "")+"_"+tmp[1])
         _, maxima, _ = fd.pull_extrema(t_tmp, data[i][1:], **kwargs_tmp)
-        ind_min = np.where(maxima[1]==np.max(maxima[1]))[0][0]
+        ind_min = int(np.argmax(maxima[1]))
         tau, nongaussian = maxima[0][ind_min], maxima[1][ind_min]
         tau = 10**tau
 
-        tmp_data.append(list(additional_entries)+[titles[i]]+[tau, nongaussian])
+        # Rows are written as they are found, the header is only written when the file is created or overwritten
+        fm.write_csv(fileout, [list(additional_entries)+[titles[i]]+[tau, nongaussian]], mode=mode if i == 1 else "a", header=file_headers)
 
-    file_headers = ["Group", "tau", "nongauss peak"]
-    if not os.path.isfile(fileout) or mode=="w":
-        if flag_add_header:
-            file_headers = list(additional_header) + file_headers
-        fm.write_csv(fileout, tmp_data, mode=mode, header=file_headers)
+
+def _read_columns(filename, delimiter=","):
+    """ Import the columns of a csv file of floats with commented lines starting with "#". The C parser of ``pandas.read_csv`` is used if pandas is installed, otherwise ``numpy.loadtxt``, and ``numpy.genfromtxt`` handles delimiters of more than one character. Floats are parsed with round trip precision so both give identical values """
+
+    try:
+        import pandas as pd
+    except ImportError:
+        pd = None
+
+    # Spaces around the delimiter are skipped, a delimiter of whitespace splits on any whitespace
+    sep = delimiter.strip() or None
+    if sep is not None and len(sep) > 1:
+        data = np.genfromtxt(filename, delimiter=sep, comments="#", ndmin=2)
+    elif pd is not None:
+        data = pd.read_csv(filename, sep=sep or r"\s+", comment="#", header=None, dtype=np.float64, engine="c", skipinitialspace=True, float_precision="round_trip").to_numpy()
     else:
-        fm.write_csv(fileout, tmp_data, mode=mode)
+        data = np.loadtxt(filename, delimiter=sep, comments="#", ndmin=2)
 
+    return np.transpose(data)
 
-def debye_waller(time, msd, use_frac=1, show_plot=False, save_plot=False, title=None, plot_name="debye-waller.png", sigma_spline=None, verbose=False):
+def debye_waller(time, msd, use_frac=1, show_plot=False, save_plot=False, title=None, plot_name="debye-waller.png", sigma_spline=None, savgol_window=None, verbose=False):
     """
     Analyzing the ballistic region of an MSD curve yields the debye-waller factor, which relates to the cage region that the atom experiences.
     DOI: 10.1073/pnas.1418654112
@@ -217,6 +255,8 @@ def debye_waller(time, msd, use_frac=1, show_plot=False, save_plot=False, title=
         If ``save_plot==True`` the msd will be saved with the debye-waller factor marked. The ``title`` is added as a prefix to this str
     sigma_spline : float, default=None
         If the data should be smoothed, provide a value of sigma used in `scipy.ndimage.gaussian_filter1d <https://docs.scipy.org/doc/scipy/reference/generated/scipy.ndimage.gaussian_filter1d.html>`_
+    savgol_window : int, default=None
+        If provided, the derivatives of the log-log msd are taken with a quintic `scipy.signal.savgol_filter <https://docs.scipy.org/doc/scipy/reference/generated/scipy.signal.savgol_filter.html>`_ of this window length instead of a fifth order spline. The time must be evenly spaced on a log scale.
     verbose : bool, default=False
         Will print intermediate values or not
     
@@ -232,50 +272,45 @@ def debye_waller(time, msd, use_frac=1, show_plot=False, save_plot=False, title=
     if not dm.isiterable(time):
         raise ValueError("Given distances, time, should be iterable")
     else:
-        time = np.array(time)
+        time = np.asarray(time, dtype=np.float64)
     if not dm.isiterable(msd):
         raise ValueError("Given radial distribution values, msd, should be iterable")
     else:
-        msd = np.array(msd)
+        msd = np.asarray(msd, dtype=np.float64)
  
     if len(msd) != len(time):
         raise ValueError("Arrays for time and msd are not of equal length.")
 
     msd = msd[:int(len(time)*use_frac)]
     time = time[:int(len(time)*use_frac)]
-    logtime = np.log10(time)
-    logmsd = np.log10(msd)
-    if np.isnan(logmsd[0]) or np.isinf(logtime[0]):
-        logtime = logtime[1:]
-        logmsd = logmsd[1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logtime = np.log10(time)
+        logmsd = np.log10(msd)
+    # Points such as t=0 have no finite log value
+    mask = np.logical_and(np.isfinite(logtime), np.isfinite(logmsd))
+    logtime, logmsd = logtime[mask], logmsd[mask]
+    if len(logmsd) < 6:
+        raise ValueError("Spline could not be created with provided data:\n{}\n{}".format(time,msd))
     if sigma_spline != None:
         logmsd = gaussian_filter1d(logmsd, sigma=sigma_spline)
 
-    if np.all(np.isnan(logmsd)):
-        raise ValueError("Spline could not be created with provided data:\n{}\n{}".format(time,msd))
-    spline = InterpolatedUnivariateSpline( logtime, logmsd, k=5)
-    dspline = spline.derivative()
-    d2spline = dspline.derivative()
-    extrema = d2spline.roots().tolist()
-    extrema_concavity = dspline.derivative().derivative()
+    if savgol_window is None:
+        spline = InterpolatedUnivariateSpline( logtime, logmsd, k=5)
+        dspline = spline.derivative()
+        d2spline = dspline.derivative()
+        extrema = d2spline.roots()
+        extrema_concavity = d2spline.derivative() # third derivative of the log-log msd
+    else:
+        spline, dspline, extrema, extrema_concavity = _savgol_derivatives(logtime, logmsd, savgol_window)
     
-    n_min = 50
-    dw = np.ones(n_min)*np.nan
-    tau = np.ones(n_min)*np.nan
-    min_value = np.ones(n_min)*np.inf
-    i = 0
-    for min_max in extrema:
-        if extrema_concavity(min_max) > 0:
-            tau[i] = 10**min_max
-            dw[i] = 10**spline(min_max)
-            min_value[i] = dspline(min_max)
-            i += 1
-        if i == n_min:
-            break
-
-    # Cut off minima after deepest
-    ind_min = np.where(min_value==np.min(min_value))[0][0]
-    min_value, dw, tau = min_value[ind_min], dw[ind_min], tau[ind_min]
+    # Minima of the log-log slope, the first 50 are considered
+    mins = extrema[extrema_concavity(extrema) > 0][:50]
+    if len(mins) > 0:
+        # Deepest minimum
+        min_max = mins[int(np.argmin(dspline(mins)))]
+        dw, tau = 10**float(spline(min_max)), 10**min_max
+    else:
+        dw, tau = np.nan, np.nan
 
     if np.isnan(dw):
         warnings.warn("This msd array does not contain a caged-region")
@@ -283,6 +318,7 @@ def debye_waller(time, msd, use_frac=1, show_plot=False, save_plot=False, title=
             print("Found debye waller factor to be {} at {}".format(dw, tau))
 
     if save_plot or show_plot:
+        import matplotlib.pyplot as plt
         fig, axs = plt.subplots(1, 2, figsize=(6,4))
         axs[0].plot(time,msd,"k",label="Data", linewidth=0.5)
         if not np.isnan(dw):
@@ -319,7 +355,51 @@ def debye_waller(time, msd, use_frac=1, show_plot=False, save_plot=False, title=
 
     return dw, tau
 
-def find_diffusivity(time, msd, min_exp=0.991, min_Npts=10, skip=1, show_plot=False, title=None, save_plot=False, plot_name="diffusivity.png", verbose=False, dim=3, use_frac=1, min_R2=0.97, bounds=(None,None)):
+def _savgol_derivatives(logtime, logmsd, window_length):
+    """
+    Smoothed log-log msd and its derivatives from a quintic Savitzky-Golay filter, to be used in place of the spline in :func:`md_spa.msd.debye_waller`.
+
+    Parameters
+    ----------
+    logtime : numpy.ndarray
+        Evenly spaced log of time
+    logmsd : numpy.ndarray
+        Log of the msd
+    window_length : int
+        Window length used in `scipy.signal.savgol_filter <https://docs.scipy.org/doc/scipy/reference/generated/scipy.signal.savgol_filter.html>`_
+
+    Returns
+    -------
+    spline : func
+        Linear interpolation of the smoothed log of the msd
+    dspline : func
+        Linear interpolation of the first derivative
+    extrema : numpy.ndarray
+        Roots of the second derivative, located at sign changes and refined with one Newton step
+    extrema_concavity : func
+        Linear interpolation of the third derivative
+
+    """
+
+    from scipy.signal import savgol_filter
+
+    delta = logtime[1] - logtime[0]
+    if not np.allclose(np.diff(logtime), delta, rtol=1e-3):
+        raise ValueError("The Savitzky-Golay filter requires a time array that is evenly spaced on a log scale.")
+
+    smoothed, d1, d2, d3 = [savgol_filter(logmsd, window_length, 5, deriv=x, delta=delta) for x in range(4)]
+    inds = np.where(np.diff(np.sign(d2)) != 0)[0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        extrema = logtime[inds] - d2[inds]/d3[inds]
+    extrema = np.where(np.logical_and(extrema >= logtime[inds], extrema <= logtime[inds+1]), extrema, (logtime[inds]+logtime[inds+1])/2)
+
+    spline = functools.partial(np.interp, xp=logtime, fp=smoothed)
+    dspline = functools.partial(np.interp, xp=logtime, fp=d1)
+    extrema_concavity = functools.partial(np.interp, xp=logtime, fp=d3)
+
+    return spline, dspline, extrema, extrema_concavity
+
+def find_diffusivity(time, msd, min_exp=0.991, min_Npts=10, skip=1, show_plot=False, title=None, save_plot=False, plot_name="diffusivity.png", verbose=False, dim=3, use_frac=1, min_R2=0.97, bounds=(None,None), flag="python", monotonic_early_exit=False):
     """
     Analyzing the long-time msd, to extract the diffusivity.
 
@@ -353,6 +433,10 @@ def find_diffusivity(time, msd, min_exp=0.991, min_Npts=10, skip=1, show_plot=Fa
         Choose what fraction of the msd to use. This will cut down on computational time in spending time on regions with poor statistics.
     bounds : tuple, default=(None,None)
         Values of time to act as the minimum or maximum of searching. It is recommended that the lower bound be ten times the timescale for the debye-waller parameter, see :func:`md_spa.msd.debye_waller`. This is applied after ``use_frac``
+    flag : str, default="python"
+        Choose to scan the regions via python or cython. The cython option does not print each region when ``verbose=True``. If the cython extension is not compiled, the python implementation is used.
+    monotonic_early_exit : bool, default=False
+        If True, the scan stops once three consecutive starting points have no region with an exponent within three times the closest distance from unity found so far. This assumes the exponent drifts away from unity smoothly with the starting point, and so is faster but may miss a later region.
     
     Returns
     -------
@@ -381,11 +465,11 @@ def find_diffusivity(time, msd, min_exp=0.991, min_Npts=10, skip=1, show_plot=Fa
     if not dm.isiterable(time):
         raise ValueError("Given distances, time, should be iterable")
     else:
-        time = np.array(time)
+        time = np.asarray(time, dtype=np.float64)
     if not dm.isiterable(msd):
         raise ValueError("Given radial distribution values, msd, should be iterable")
     else:
-        msd = np.array(msd)
+        msd = np.asarray(msd, dtype=np.float64)
 
     if len(msd) != len(time):
         raise ValueError("Arrays for time and msd are not of equal length.")
@@ -413,26 +497,19 @@ def find_diffusivity(time, msd, min_exp=0.991, min_Npts=10, skip=1, show_plot=Fa
         warnings.warn("Resetting minimum number of points, {}, to be within length of provided data * use_frac, {}".format(min_Npts,len(time)))
         min_Npts = len(time)-1
 
-    best = np.array([np.nan for x in range(7)])
-    longest = np.array([np.nan for x in range(7)])
-    for npts in range(min_Npts,len(time),skip):
-        for i in range(0,len(time)-npts,skip):
-            t_tmp = time[i:(i+npts)]
-            msd_tmp = msd[i:(i+npts)]
-            d_tmp, stder_tmp, exp_tmp, intercept, r2_tmp = diffusivity(t_tmp, msd_tmp, verbose=verbose, dim=dim)
-
-            if r2_tmp > min_R2:
-                if np.abs(exp_tmp-1.0) < np.abs(best[4]-1.0) or np.isnan(best[4]):
-                    best = np.array([d_tmp, stder_tmp, t_tmp[0], t_tmp[-1], exp_tmp, intercept, npts])
+    if flag == "cython" and cdiff is None:
+        warnings.warn("The cython extension, md_spa.cython_modules._diffusivity, is not compiled. Using flag='python'.")
+        flag = "python"
 
-                if (exp_tmp >=  min_exp and longest[-1] <= npts) or np.isnan(longest[4]):
-                    if (longest[-1] < npts or np.abs(longest[4]-1.0) > np.abs(exp_tmp-1.0)) or np.isnan(longest[4]):
-                        longest = np.array([d_tmp, stder_tmp, t_tmp[0], t_tmp[-1], exp_tmp, intercept, npts])
-
-                if verbose:
-                    print("Region Diffusivity: {} +- {}, from Time: {} to {}, with and exponent of {} using {} points, Exp Rsquared: {}".format(d_tmp, stder_tmp, t_tmp[0], t_tmp[-1], exp_tmp, npts, r2_tmp))
+    if flag == "python":
+        best, longest = _scan_regions(time, msd, min_Npts, skip, dim=dim, min_R2=min_R2, min_exp=min_exp, verbose=verbose, monotonic_early_exit=monotonic_early_exit)
+    elif flag == "cython":
+        best, longest = cdiff.scan_regions(time, msd, int(min_Npts), int(skip), dim, min_R2, min_exp, bool(monotonic_early_exit))
+    else:
+        raise ValueError("The flag, {}, is not recognized. Choose: 'python' or 'cython'.".format(flag))
 
     if save_plot or show_plot:
+        import matplotlib.pyplot as plt
         plt.plot(time,msd,"k",label="Data", linewidth=0.5)
         tmp_time = np.array([time[0],time[-1]])
         tmp_best = tmp_time*best[0]*2*dim+best[5]
@@ -459,6 +536,55 @@ def find_diffusivity(time, msd, min_exp=0.991, min_Npts=10, skip=1, show_plot=Fa
 
     return best, longest
 
+def _scan_regions(time, msd, min_Npts, skip, dim=3, min_R2=0.97, min_exp=0.991, verbose=False, monotonic_early_exit=False):
+    """
+    Scan the regions of an msd curve for the best and longest linear regions, see :func:`md_spa.msd.find_diffusivity` for a description of the parameters and outputs.
+    """
+
+    best = np.array([np.nan for x in range(7)])
+    longest = np.array([np.nan for x in range(7)])
+    # Regions are ranked as if scanned from the shortest to the longest, and then by starting point
+    best_key = (np.inf, np.inf, np.inf) # |exponent-1|, npts, start
+    first_key, first = (np.inf, np.inf), None # npts, start of the first acceptable region
+    longest_key = (np.inf, np.inf, np.inf) # -npts, |exponent-1|, start
+    drift = 0 # Number of consecutive starting points without a region near the best exponent
+    for i in range(0,len(time)-min_Npts,skip):
+        if drift >= 3:
+            break
+        npts = np.arange(min_Npts,len(time)-i,skip)
+        regions, r2_tmp = _region_regressions(time[i:], msd[i:], npts, dim=dim)
+        valid = r2_tmp > min_R2
+        if monotonic_early_exit:
+            start_err = np.min(np.abs(regions[valid,4]-1.0)) if np.any(valid) else np.inf
+            drift = drift+1 if start_err > 3*best_key[0] else 0
+        if not np.any(valid):
+            continue
+        regions = regions[valid]
+        exp_err = np.abs(regions[:,4]-1.0)
+
+        ind = np.argmin(exp_err)
+        if (exp_err[ind], regions[ind,6], i) < best_key:
+            best_key, best = (exp_err[ind], regions[ind,6], i), regions[ind]
+
+        if (regions[0,6], i) < first_key:
+            first_key, first = (regions[0,6], i), (regions[0], exp_err[0])
+
+        inds = np.where(regions[:,4] >= min_exp)[0]
+        if len(inds) > 0:
+            ind = inds[-1]
+            if (-regions[ind,6], exp_err[ind], i) < longest_key:
+                longest_key, longest = (-regions[ind,6], exp_err[ind], i), regions[ind]
+
+        if verbose:
+            for d_tmp, stder_tmp, t0_tmp, t1_tmp, exp_tmp, _, npts_tmp, r2 in np.column_stack((regions, r2_tmp[valid])):
+                print("Region Diffusivity: {} +- {}, from Time: {} to {}, with and exponent of {} using {} points, Exp Rsquared: {}".format(d_tmp, stder_tmp, t0_tmp, t1_tmp, exp_tmp, int(npts_tmp), r2))
+
+    # The first acceptable region is kept as the longest region until one with an exponent of at least min_exp replaces it
+    if first is not None and (-first_key[0], first[1], first_key[1]) <= longest_key:
+        longest = first[0]
+
+    return best, longest
+
 def msd(coords):
     """
     Calculate the MSD averaged over the number of particles and dimensions using FFT method described in DOI: 10.1051/sfn/201112010 
@@ -478,39 +604,114 @@ def msd(coords):
     """
 
 
-    if len(np.shape(np.array(coords))) == 1:
+    coords = np.asarray(coords, dtype=float)
+    if coords.ndim == 1:
         raise ValueError("An MSD cannot be calculated with a 1D array.")
-    if len(np.shape(np.array(coords))) == 2:
-        coords = np.array([coords])
-    nparticles, npts, dims = np.shape(np.array(coords))
+    if coords.ndim == 2:
+        coords = coords[None, :, :]
+    nparticles, npts, dims = np.shape(coords)
 
-    for i in range(nparticles):
-        coords[i] = coords[i]-coords[i][0]
+    coords = coords - coords[:, :1, :]
 
-    particle_msd = np.zeros((nparticles,npts, dims))
     DSQ = np.sum(np.square(coords), axis=2) # 2D (nparticles, npts)
-    DSQ = np.concatenate((DSQ, np.zeros((nparticles,1))), axis=1)
     SUMSQ = 2*np.sum(DSQ, axis=1) # 1D (nparticles)
 
-    particle_msd = np.zeros((nparticles,npts))
-    for i,particle in enumerate(coords):
-        Sab = np.zeros(npts)
-        for dim in range(dims):
-            Sab += dm.autocorrelation(particle[:,dim])
+    # Autocorrelation of every particle and dimension with one FFT, summed over dimensions
+    fft_coords = np.fft.rfft(coords, n=2*npts, axis=1)
+    Sab = np.fft.irfft(fft_coords.real**2 + fft_coords.imag**2, n=2*npts, axis=1)[:, :npts, :]
+    Sab = np.sum(Sab, axis=2) / (npts - np.arange(npts)) # 2D (nparticles, npts)
 
-        for t in range(npts):
-            SUMSQ[i] -= (DSQ[i,t-1] + DSQ[i,npts-t])
-            particle_msd[i,t] = SUMSQ[i] / (npts - t) - 2*Sab[t]
+    # Remove the squared displacements of the first and last t points from the sum for each lag time t
+    zeros = np.zeros((nparticles,1))
+    left = np.concatenate((zeros, np.cumsum(DSQ[:, :-1], axis=1)), axis=1)
+    right = np.concatenate((zeros, np.cumsum(DSQ[:, :0:-1], axis=1)), axis=1)
+    particle_msd = (SUMSQ[:, None] - left - right) / (npts - np.arange(npts)) - 2*Sab
 
     msd = np.mean(particle_msd, axis=0)
     if nparticles > 1:
-        stderror = np.mean(msd, axis=0)/np.sqrt(nparticles)
+        stderror = np.std(particle_msd, axis=0, ddof=1)/np.sqrt(nparticles)
     else:
-        stderror = np.nan*np.ones(npts)
+        stderror = np.full(npts, np.nan)
 
     return msd, stderror
 
-def diffusivity(time, msd, verbose=False, dim=3):
+def _region_regressions(time, msd, npts, dim=3, log_time=None, log_msd=None):
+    """
+    Perform the regressions of :func:`md_spa.msd.diffusivity` for the regions ``time[:n]`` and ``msd[:n]`` for each ``n`` in ``npts`` using cumulative sums.
+
+    Parameters
+    ----------
+    time : numpy.ndarray
+        Time array of the same length at MSD
+    msd : numpy.ndarray
+        MSD array with one dimension
+    npts : numpy.ndarray
+        Array of region lengths, each must be at least three
+    dim : int, default=3
+        Dimensions of the system, usually 3
+    log_time : numpy.ndarray, default=None
+        Precomputed ``np.log(time[1:]-time[0])``, if None it is calculated
+    log_msd : numpy.ndarray, default=None
+        Precomputed ``np.log(msd[1:]-msd[0])``, if None it is calculated
+
+    Returns
+    -------
+    regions : numpy.ndarray
+        Array of shape ``(len(npts), 7)`` containing, for each region, the diffusivity, standard error of diffusivity, time interval, exponent, intercept, and number of points as output in :func:`md_spa.msd.find_diffusivity`
+    r_squared : numpy.ndarray
+        Coefficient of determination for the linear fitted log-log plot of each region
+
+    """
+
+    # Shift by the first point to condition the sums, the slopes are unaffected
+    x = time - time[0]
+    y = msd - msd[0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if log_time is None:
+            log_time = np.log(x[1:])
+        if log_msd is None:
+            log_msd = np.log(y[1:])
+        slope, intercept, stderr, _ = _cumulative_linregress(x, y, npts)
+        exponent, _, _, r_squared = _cumulative_linregress(log_time, log_msd, npts-1)
+    intercept += msd[0] - slope*time[0]
+
+    regions = np.column_stack((slope/2/dim, stderr/2/dim, np.full(len(npts), time[0]), time[npts-1], exponent, intercept, npts))
+
+    return regions, r_squared
+
+def _cumulative_linregress(x, y, npts):
+    """
+    Least squares regression of ``y[:n]`` against ``x[:n]`` for each ``n`` in ``npts``, equivalent to `scipy.stats.linregress <https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.linregress.html>`_ for each region.
+
+    Returns
+    -------
+    slope : numpy.ndarray
+        Slope of each region
+    intercept : numpy.ndarray
+        Intercept of each region
+    stderr : numpy.ndarray
+        Standard error of the slope of each region
+    r_squared : numpy.ndarray
+        Coefficient of determination of each region
+
+    """
+
+    # Running sums of x, y, x^2, y^2, and xy in a single pass
+    n = npts.astype(float)
+    sums = np.cumsum(np.stack((x, y, x*x, y*y, x*y)), axis=1)[:, npts-1] / n
+    xmean, ymean = sums[0], sums[1]
+    ssxm = sums[2] - xmean**2
+    ssym = sums[3] - ymean**2
+    ssxym = sums[4] - xmean*ymean
+
+    r = np.clip(ssxym/np.sqrt(ssxm*ssym), -1.0, 1.0)
+    slope = ssxym/ssxm
+    intercept = ymean - slope*xmean
+    stderr = np.sqrt((1 - r**2)*ssym/ssxm/(n - 2))
+
+    return slope, intercept, stderr, r**2
+
+def diffusivity(time, msd, verbose=False, dim=3, log_time=None, log_msd=None):
     """
     Analyzing the long-time msd, to extract the diffusivity. This entire region is used and so should be linear.
 
@@ -524,6 +725,10 @@ def diffusivity(time, msd, verbose=False, dim=3):
         Will print intermediate values or not
     dim : int, default=3
         Dimensions of the system, usually 3
+    log_time : numpy.ndarray, default=None
+        Precomputed ``np.log(time[1:]-time[0])`` to reuse when the same time array is evaluated often, if None it is calculated
+    log_msd : numpy.ndarray, default=None
+        Precomputed ``np.log(msd[1:]-msd[0])``, if None it is calculated
     
     Returns
     -------
@@ -543,26 +748,26 @@ def diffusivity(time, msd, verbose=False, dim=3):
     if not dm.isiterable(time):
         raise ValueError("Given distances, time, should be iterable")
     else:
-        time = np.array(time)
+        time = np.asarray(time, dtype=np.float64)
     if not dm.isiterable(msd):
         raise ValueError("Given radial distribution values, msd, should be iterable")
     else:
-        msd = np.array(msd)
+        msd = np.asarray(msd, dtype=np.float64)
 
     if len(msd) != len(time):
         raise ValueError("Arrays for time and msd are not of equal length.")
+    if log_time is not None and len(log_time) != len(time)-1:
+        raise ValueError("The array, log_time, should be one shorter than time.")
+    if log_msd is not None and len(log_msd) != len(msd)-1:
+        raise ValueError("The array, log_msd, should be one shorter than msd.")
 
-    # Find Exponent
-    t_log = np.log(time[1:]-time[0])
-    msd_log = np.log(msd[1:]-msd[0])
-    result = linregress(t_log,msd_log)
-    exponent = result.slope
-    r_squared = result.rvalue**2
-
-    result = linregress(time,msd)
-    diffusivity = result.slope/2/dim
-    sterror = result.stderr/2/dim
-    intercept = result.intercept
+    # Exponent and slope from closed form sums over the whole region
+    regions, r_squared = _region_regressions(time, msd, np.array([len(time)]), dim=dim, log_time=log_time, log_msd=log_msd)
+    diffusivity, sterror, _, _, exponent, intercept, _ = regions[0]
+    r_squared = r_squared[0]
+
+    if verbose:
+        print("Diffusivity: {} +- {}, with and exponent of {}, Exp Rsquared: {}".format(diffusivity, sterror, exponent, r_squared))
 
     return diffusivity, sterror, exponent, intercept, r_squared
 
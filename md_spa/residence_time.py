@@ -259,7 +259,7 @@ def keypoints2csv(filename, fileout="res_time.csv", mode="a", delimiter=",", tit
 
         if len(np.where(np.isnan(data[i][1:7]))[0]) == 6: # Least-squares fit will not function with number of points less than number of parameters for 3 exponentials
             output = np.nan*np.ones(12)
-        elif len(np.where(data[i][1:7] < np.finfo(np.float).eps)[0]) != 0: # Least-squares fit will not function with number of points less than number of parameters for 3 exponentials
+        elif len(np.where(data[i][1:7] < np.finfo(np.float64).eps)[0]) != 0: # Least-squares fit will not function with number of points less than number of parameters for 3 exponentials
             output = np.zeros(12)
         else:
             tmp_in = np.array([0. if np.isnan(x) else x for x in data[i]])
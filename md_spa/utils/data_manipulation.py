@@ -1,6 +1,7 @@
 
+import re
+import functools
 import numpy as np
-import scipy.stats
 
 def basic_stats(data, axis=None, data_type="individuals", error_type="standard_deviation", error_descriptor="mean", confidence=0.95, population_dist_type="unknown", verbose=False):
     """
@@ -44,11 +45,11 @@ def basic_stats(data, axis=None, data_type="individuals", error_type="standard_d
         print("Evaluating {}, to describe the {} with the {} of a(n) {} population".format(
             data_type, error_descriptor, error_type, population_dist_type))
 
-    data = np.array(data, float)
+    data = np.asarray(data, dtype=np.float64)
     if not isiterable(data):
         raise ValueError("Input data is not iterable")
  
-    if np.size(data) == 0 and np.size(data) == np.isnan(data).sum():
+    if np.size(data) == 0:
         mean = np.nan
         spread = np.nan
 
@@ -57,24 +58,15 @@ def basic_stats(data, axis=None, data_type="individuals", error_type="standard_d
     if data_type == "means" and error_descriptor == "mean":
         raise ValueError("If the provided data is a set of sample means, the error_descriptor should be 'sample', since the mean of this dataset is already the standard error.")
 
-    # Find the sample size(s)
-    if axis is None:
-        lx = np.prod(np.shape(data)) - np.isnan(data).sum()
-    elif isinstance(axis, tuple):
-        not_axis = (x for x in range(len(np.shape(data))) if x not in axis)
-        lx = np.prod([x for i,x in enumerate(np.shape(data)) if i in axis])*np.ones(not_axis)
-        lx -= np.isnan(data).sum(axis)
-    elif isinstance(axis, int):
-        lx = np.shape(data)[axis] - np.isnan(data).sum(axis)
-    else:
+    if axis is not None and not isinstance(axis, (int, tuple)):
         raise ValueError("This entry for 'axis' is not valid: {}".format(axis))
 
-    mean = np.nanmean(data, axis=axis)
+    # Mean, standard deviation, and sample size(s) from a single NaN mask
+    mean, spread, lx = _nan_mean_std(data, axis=axis)
     if error_descriptor == "mean": # If standard error is desired from sample population
-        spread = np.nanstd(data, axis=axis)
         spread = spread / np.sqrt(lx)
     elif error_descriptor == "sample":
-        spread = np.nanstd(data, axis=axis)
+        pass
     else:
         raise ValueError("error_descriptor, {}, is not supported, should be 'mean' or 'sample'".format(error_descriptor))
    
@@ -87,16 +79,74 @@ def basic_stats(data, axis=None, data_type="individuals", error_type="standard_d
         spread = spread**2
     elif error_type == "confidence":
         if np.all(lx >= 30) or population_dist_type == "normal":
+            import scipy.stats
             spread = spread * scipy.stats.norm.interval(confidence, scale=1, loc=0)[-1]
         else:
             if verbose:
                 print("Using t-distribution")
-            spread = spread * scipy.stats.t.interval(confidence, scale=1, loc=0, df=lx-1)[-1]
+            spread = spread * _t_critical(confidence, lx-1)
     else:
         raise ValueError("error_type, {}, is not supported".format(error_type))
 
     return mean, spread
 
+def _nan_mean_std(data, axis=None):
+    """
+    Mean, standard deviation, and number of values that are not NaN along an axis, equivalent to ``numpy.nanmean``, ``numpy.nanstd``, and counting the values, but computed from one NaN mask.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Array of floats
+    axis : int/tuple, default=None
+        Axis or axes over which to compute the statistics, if None all values are used
+
+    Returns
+    -------
+    mean : numpy.ndarray
+        Mean of values that are not NaN
+    std : numpy.ndarray
+        Population standard deviation of values that are not NaN
+    count : numpy.ndarray
+        Number of values that are not NaN
+
+    """
+
+    valid = ~np.isnan(data)
+    if axis is None:
+        # Strip NaN values once so the plain reductions are used
+        clean = data[valid]
+        if clean.size == 0:
+            return np.nan, np.nan, 0
+        return np.mean(clean), np.std(clean), clean.size
+
+    count = np.sum(valid, axis=axis, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        deviation = np.where(valid, data, 0.0)
+        mean = np.sum(deviation, axis=axis, keepdims=True) / count
+        # NaN values are already zeroed, so the mask is applied by multiplication in place
+        deviation -= mean
+        deviation *= valid
+        deviation *= deviation
+        std = np.sqrt(np.sum(deviation, axis=axis, keepdims=True) / count)
+
+    shape = np.shape(np.sum(valid, axis=axis))
+    return np.reshape(mean, shape)[()], np.reshape(std, shape)[()], np.reshape(count, shape)[()]
+
+def _t_critical(confidence, df):
+    """ Two-sided t-statistic for a confidence interval, ``scipy.stats.t.interval(confidence, df=df)[-1]``, from cached values for each unique degree of freedom """
+    if np.ndim(df) == 0:
+        return _t_ppf((1+confidence)/2., int(df))
+    dfs, inverse = np.unique(df, return_inverse=True)
+    values = np.array([_t_ppf((1+confidence)/2., int(x)) for x in dfs])
+    return np.reshape(values[inverse], np.shape(df))
+
+@functools.lru_cache(maxsize=4096)
+def _t_ppf(q, df):
+    """ Cached ``scipy.stats.t.ppf``, the same sample sizes and confidence are repeated across calls to :func:`md_spa.utils.data_manipulation.basic_stats` """
+    import scipy.stats
+    return float(scipy.stats.t.ppf(q, df))
+
 def skewness(data, kwargs={}):
     """
     Given a set of data, calculate the skewness and its standard error. If skewness/SE is greater than 1.96 then the distribution is not in the 95% confidence interval of normality. By default the adjusted Fisher-Pearson standardized moment coefficient to correct for sample bias with the default kwargs.
@@ -125,10 +175,19 @@ def skewness(data, kwargs={}):
     if not isiterable(data):
         raise ValueError("Input data is not iterable")
  
-    if len(data) != 0 or len(data) != np.isnan(data).sum():
-        data = np.array(data,np.float)
-        lx = len(data) - np.isnan(data).sum()
-        skewness = scipy.stats.skew(data, **tmp_kwargs)
+    data = np.asarray(data, dtype=np.float64)
+    nan_mask = np.isnan(data)
+    n_nan = nan_mask.sum()
+    if len(data) != 0 or len(data) != n_nan:
+        lx = len(data) - n_nan
+        if tmp_kwargs["nan_policy"] == "omit" and n_nan > 0 and data.ndim == 1:
+            # Remove NaN values once rather than through a masked array in scipy
+            data = data[~nan_mask]
+        if set(tmp_kwargs) <= {"bias", "nan_policy"} and data.ndim == 1 and data.size > 0 and (n_nan == 0 or tmp_kwargs["nan_policy"] != "raise"):
+            skewness = _skew(data, bias=tmp_kwargs["bias"])
+        else:
+            import scipy.stats
+            skewness = scipy.stats.skew(data, **tmp_kwargs)
         skew_se = np.sqrt(6.*lx*(lx-1.)/((lx-2.)*(lx+1.)*(lx+3.)))
 
     else:
@@ -137,6 +196,23 @@ def skewness(data, kwargs={}):
 
     return skewness, skew_se
 
+def _skew(data, bias=False):
+    """ Skewness of a 1D array, equivalent to ``scipy.stats.skew``, from the second and third central moments of a single array of deviations """
+    n = data.size
+    mean = np.mean(data)
+    deviation = data - mean
+    square = deviation*deviation
+    m2 = np.mean(square)
+    m3 = np.mean(square*deviation)
+    with np.errstate(all="ignore"):
+        if m2 <= (np.finfo(np.float64).eps*mean)**2:
+            return np.float64(np.nan)
+        skewness = m3 / m2**1.5
+        if not bias and n > 2:
+            skewness = np.sqrt((n-1.0)*n) / (n-2.0) * skewness
+
+    return skewness
+
 def isiterable(array):
     """
     Check if variable is an iterable type with a length (e.g. np.array or list)
@@ -157,15 +233,20 @@ def isiterable(array):
 
     """
 
-    array_tmp = np.array(array, dtype=object)
-    tmp = np.shape(array_tmp)
+    # Answered from the type and length alone, strings and mappings are treated as scalars as numpy would
+    if isinstance(array, np.ndarray):
+        return array.ndim > 0
+    if isinstance(array, (str, bytes, dict, set, frozenset)):
+        return False
+    try:
+        len(array)
+    except TypeError:
+        return False
 
-    if tmp:
-        isiterable = True
-    else:
-        isiterable = False
+    return True
 
-    return isiterable
+_DIGITS = r"[0-9](?:_?[0-9])*"
+_FLOAT_STRING = re.compile(r"\s*[+-]?(?:(?:{d}(?:\.(?:{d})?)?|\.{d})(?:[eE][+-]?{d})?|inf(?:inity)?|nan)\s*\Z".format(d=_DIGITS), re.IGNORECASE | re.ASCII)
 
 def isfloat(string):
     """
@@ -183,6 +264,10 @@ def isfloat(string):
 
     """
 
+    # ASCII strings are matched against the grammar accepted by float() without raising an exception
+    if isinstance(string, str) and string.isascii():
+        return _FLOAT_STRING.match(string) is not None
+
     try:
         float(string)
         flag = True
@@ -209,6 +294,18 @@ def array2dict(array, keys):
     """
 
     dictionary = {}
+    if isinstance(array, np.ndarray) and array.ndim == 2 and array.dtype != object:
+        # Group rows of a numeric array with one sort, keys are kept in order of first appearance
+        if array.shape[1] != len(keys)+1:
+            raise ValueError("The number of keys must equal the number of entries len(array[i][1:])")
+        groups, first, inverse = np.unique(array[:,0], return_index=True, return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.cumsum(np.bincount(inverse))[:-1]
+        columns = [np.split(array[order, i], bounds) for i in range(1, len(keys)+1)]
+        for ind in np.argsort(first):
+            dictionary[groups[ind]] = {key: list(columns[i][ind]) for i, key in enumerate(keys)}
+        return dictionary
+
     for line in array:
        if line[0] not in dictionary:
            dictionary[line[0]] = {key: [] for key in keys}
@@ -219,42 +316,77 @@ def array2dict(array, keys):
 
     return dictionary
 
-def autocorrelation(x, mode="fft"):
+def autocorrelation(x, mode="fft", axis=-1, workers=-1):
     """
     Calculate the Autocorrelation function using FFT and multiple time origins.
 
     Parameters
     ----------
     x : numpy.ndarray
-        Input function for which to calculate the autocorrelation function
+        Input function for which to calculate the autocorrelation function. If more than one dimension is provided, the autocorrelation function of each signal along ``axis`` is calculated at once.
     mode : str, Optional, default="fft"
         Method of calculating the autocorrelation function. FFT is two orders of magnitude faster than the ``loop`` method, and twice as fast as the numpy.correlate.
        
         - fft: Using Fourier transform to calculate the autocorrelation funct
-        - numpy: Use np.correlate with multiple start times
+        - numpy: Use ``scipy.signal.correlate`` with multiple start times, which chooses a direct or FFT method from the signal length
         - loop: Hard coded loop taken from methematical definition
 
+    axis : int, Optional, default=-1
+        Axis of ``x`` along which the signal is defined
+    workers : int, Optional, default=-1
+        Number of workers passed to ``scipy.fft`` when ``mode="fft"``, a negative value uses all cores. Signals in a multidimensional ``x`` are transformed in parallel.
+
     Returns
     -------
     Cx : numpy.ndarray
-        Autocorrelation function
+        Autocorrelation function with the same shape as ``x``
     """
 
-    lx = len(x)
-    norm = (lx-np.arange(0,lx))
+    # Single precision input, such as trajectories from MDAnalysis, is correlated in double precision
+    x = np.asarray(x)
+    x = np.asarray(x, dtype=np.result_type(x, np.float64))
+    last = axis in (-1, x.ndim-1)
+    if not last:
+        x = np.moveaxis(x, axis, -1)
+    lx = x.shape[-1]
 
     if mode == "fft":
-        Cx = np.fft.ifft( np.abs(np.fft.fft(x, n=2*lx))**2)[:lx].real
+        import scipy.fft
+        # Zero pad to at least 2*lx-1 to avoid wrap around, using a length with small prime factors
+        n = scipy.fft.next_fast_len(2*lx-1)
+        if np.isrealobj(x):
+            # Half spectrum of real input, power without the abs temporary
+            Fx = scipy.fft.rfft(x, n=n, axis=-1, workers=workers)
+            Cx = scipy.fft.irfft(Fx.real*Fx.real + Fx.imag*Fx.imag, n=n, axis=-1, overwrite_x=True, workers=workers)[..., :lx]
+        else:
+            Fx = scipy.fft.fft(x, n=n, axis=-1, workers=workers)
+            Cx = scipy.fft.ifft(Fx.real*Fx.real + Fx.imag*Fx.imag, axis=-1, overwrite_x=True, workers=workers)[..., :lx].real
     elif mode == "numpy":
-        Cx = np.correlate(x, x, mode='full')[lx-1:]
+        import scipy.signal
+        Cx = np.zeros(x.shape, dtype=np.result_type(x, np.float64))
+        for ind in np.ndindex(x.shape[:-1]):
+            Cx[ind] = scipy.signal.correlate(x[ind], x[ind], mode='full', method='auto')[lx-1:]
     elif mode == "loop":
-        Cx = np.zeros(lx)
-        for j in range(lx):
-            Cx[:lx-j] += x[j]*x[j:]
+        # Each lag is an independent sum over time origins
+        Cx = np.zeros(x.shape)
+        for k in range(lx):
+            Cx[..., k] = np.einsum("...i,...i->...", x[..., :lx-k], x[..., k:])
     else:
         raise ValueError("The autocorrelation method, {}, is not supported".format(mode))
 
-    return Cx/norm
+    Cx /= _acf_norm(lx)
+
+    if not last:
+        Cx = np.moveaxis(Cx, -1, axis)
+
+    return Cx
+
+@functools.lru_cache(maxsize=64)
+def _acf_norm(lx):
+    """ Read-only number of time origins for each lag of :func:`md_spa.utils.data_manipulation.autocorrelation`, reused across signals of the same length """
+    norm = (lx-np.arange(0,lx)).astype(np.float64)
+    norm.flags.writeable = False
+    return norm
 
 def remove_duplicate_pairs(array):
     """
@@ -275,14 +407,26 @@ def remove_duplicate_pairs(array):
 
     if not isiterable(array):
         raise ValueError("Provided array should be iterable")
-    if array and (not isiterable(array[0]) or len(array[0]) < 2):
+    if isinstance(array, np.ndarray) and array.dtype != object:
+        # Numeric arrays are deduplicated with one sort, keeping the first row of each pair in order
+        if array.ndim != 2 or array.shape[1] < 2:
+            raise ValueError("Each element in the second dimension must be iterable and at least of length two.")
+        order = np.lexsort((array[:, 1], array[:, 0]))
+        first = np.ones(len(order), dtype=bool)
+        pairs = array[order, :2]
+        first[1:] = np.any(pairs[1:] != pairs[:-1], axis=1)
+        return list(array[np.sort(order[first])])
+
+    if len(array) and (not isiterable(array[0]) or len(array[0]) < 2):
         raise ValueError("Each element in the second dimension must be iterable and at least of length two.")
 
+    # The first entry of each pair of values is kept
     new_array = []
+    pairs = set()
     for tmp_set in array:
-        if tmp_set[0] not in [tmp[0] for tmp in new_array]:
-            new_array.append(tmp_set)
-        elif tmp_set[1] not in [tmp for tmp in [tmp2[1] for tmp2 in new_array if tmp2[0]==tmp_set[0]]]:
+        pair = (tmp_set[0], tmp_set[1])
+        if pair not in pairs:
+            pairs.add(pair)
             new_array.append(tmp_set)
 
     return new_array
@@ -6,6 +6,7 @@
 """
 
 import copy
+import warnings
 import numpy as np
 import os
 import matplotlib.pyplot as plt
@@ -313,7 +314,7 @@ def running_acf_integral(time, p_xy, error_type="standard error", scale_coeffici
     p_new, lx, labels = _dim_integrals(p_xy, dims)
 
     # Same result whether the integral is taken before or after averaging the tensor components
-    acf_set = np.array([dm.autocorrelation(x) for x in p_new])
+    acf_set = dm.autocorrelation(p_new)
     integral_set = np.array([integrate.cumtrapz(x, time, initial=0) for x in acf_set])
     eta = np.mean(integral_set, axis=0)
     stnderror = np.sqrt(np.sum(np.square(integral_set-eta), axis=0)/(lx-1))
@@ -434,7 +435,7 @@ def dynamic_shear_modulus(time, p_xy, error_type="standard error", scale_coeffic
     p_new[2:] = p_xy[3:]
 
     # Same result whether the integral is taken before or after averaging the tensor components
-    acf_set = np.array([dm.autocorrelation(x) for x in p_new])
+    acf_set = dm.autocorrelation(p_new)
     Gshear = np.mean(acf_set, axis=0)
     stnderror = np.sqrt(np.sum(np.square(acf_set-Gshear), axis=0)/(lx-1))
     if error_type == "standard error":
@@ -1065,7 +1066,7 @@ def find_einstein_viscosity(time, cumulative_integral,  min_exp=0.991, min_Npts=
     npts = len(time)
 
     if min_Npts > len(time):
-        warning.warn("Resetting minimum number of points, {}, to be within length of provided data cut with `fit_limits`, {}".format(min_Npts,len(time)))
+        warnings.warn("Resetting minimum number of points, {}, to be within length of provided data cut with `fit_limits`, {}".format(min_Npts,len(time)))
         min_Npts = len(time)-1
 
     best = np.array([np.nan for x in range(7)])
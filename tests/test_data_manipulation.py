@@ -0,0 +1,28 @@
+"""Tests for `md_spa.utils.data_manipulation`."""
+
+import numpy as np
+import pytest
+
+from md_spa.utils import data_manipulation as dm
+
+
+@pytest.mark.parametrize("mode", ["fft", "numpy", "loop"])
+def test_autocorrelation_float32_matches_float64(mode):
+    """Single precision input is correlated in double precision."""
+    rng = np.random.default_rng(0)
+    x = (100 + np.cumsum(rng.normal(size=2**12))).astype(np.float32)
+
+    Cx32 = dm.autocorrelation(x, mode=mode)
+    Cx64 = dm.autocorrelation(x.astype(np.float64), mode=mode)
+
+    assert Cx32.dtype == np.float64
+    assert np.allclose(Cx32, Cx64, rtol=1e-12)
+
+
+def test_skewness_omits_nan():
+    """NaN values are removed before the skewness is computed."""
+    rng = np.random.default_rng(1)
+    data = rng.exponential(size=200)
+    data_nan = np.insert(data, [3, 50, 120], np.nan)
+
+    assert np.allclose(dm.skewness(data_nan), dm.skewness(data), rtol=1e-12)
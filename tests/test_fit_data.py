@@ -0,0 +1,43 @@
+"""Tests for `md_spa.fit_data`."""
+
+import numpy as np
+
+import md_spa.fit_data as fd
+
+
+def test_extract_gaussians_from_peaks():
+    """Number of gaussians and peak locations extracted from the data."""
+    x = np.linspace(0, 10, 200)
+    y = 2*np.exp(-(x-3)**2/(2*0.5**2)) + np.exp(-(x-7)**2/(2*0.8**2))
+
+    parameters, uncertainties, redchi = fd.extract_gaussians(x, y)
+
+    assert np.shape(parameters) == (2, 3)
+    assert np.shape(uncertainties) == (2, 3)
+    assert np.allclose(parameters[:, 1], [3, 7], atol=1e-3)
+    assert np.allclose(parameters[:, 0], [2, 1], atol=0.1)
+    assert np.allclose(parameters[:, 2], [0.5, 0.8], atol=0.01)
+    assert redchi < 1e-3
+
+
+def test_extract_gaussians_keeps_kwargs():
+    """The given keyword arguments are not modified."""
+    x = np.linspace(0, 10, 200)
+    y = 2*np.exp(-(x-3)**2/(2*0.5**2)) + np.exp(-(x-7)**2/(2*0.8**2))
+    kwargs_fit = {"kwargs_parameters": {"b1": {"value": 3}, "b2": {"value": 7}}}
+
+    parameters, _, _ = fd.extract_gaussians(x, y, n_gaussians=2, kwargs_fit=kwargs_fit)
+
+    assert kwargs_fit == {"kwargs_parameters": {"b1": {"value": 3}, "b2": {"value": 7}}}
+    assert np.allclose(parameters, [[2, 3, 0.5], [1, 7, 0.8]], atol=1e-4)
+
+
+def test_pull_extrema_sine():
+    """Extrema and inflection points of a sine wave."""
+    x = np.linspace(0, 2*np.pi, 200)
+
+    minima, maxima, inflections = fd.pull_extrema(x, np.sin(x) + 2)
+
+    assert np.allclose(minima, [[3*np.pi/2], [1]], atol=1e-4)
+    assert np.allclose(maxima, [[np.pi/2], [3]], atol=1e-4)
+    assert np.any(np.isclose(inflections[0], np.pi, atol=1e-3))
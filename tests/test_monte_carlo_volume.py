@@ -0,0 +1,32 @@
+"""Tests for `md_spa.monte_carlo_volume`."""
+
+import numpy as np
+import pytest
+
+import md_spa.monte_carlo_volume as mcv
+
+
+@pytest.mark.parametrize("flag", ["python", "cython"])
+def test_overlapping_spheres_single_sphere(flag):
+    """The volume of one sphere is recovered within the Monte Carlo error."""
+    if flag == "cython":
+        pytest.importorskip("md_spa.cython_modules._monte_carlo")
+
+    volume, volume_std = mcv.overlapping_spheres(1.5, [[0., 0., 0.]], npts=1e+5, flag=flag, seed=0)
+
+    assert np.isclose(volume, 4/3*np.pi*1.5**3, rtol=1e-2)
+    assert volume_std < 0.1
+
+
+def test_overlapping_spheres_cython_matches_python():
+    """The early-exit cython kernel counts the same points as the tiled python implementation."""
+    pytest.importorskip("md_spa.cython_modules._monte_carlo")
+    rng = np.random.default_rng(3)
+    ref_pts = rng.random((20, 3))*3
+    rcut = rng.uniform(0.5, 1, 20)
+
+    python = mcv.overlapping_spheres(rcut, ref_pts, npts=2e+4, flag="python", seed=7)
+    cython = mcv.overlapping_spheres(rcut, ref_pts, npts=2e+4, flag="cython", seed=7)
+
+    # Points exactly on a sphere surface may round differently, each point is 1/npts of the box
+    assert np.allclose(python, cython, rtol=1e-3)
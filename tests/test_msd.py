@@ -0,0 +1,93 @@
+"""Tests for `md_spa.msd`."""
+
+import sys
+
+import numpy as np
+import pytest
+
+import md_spa.msd as msd
+
+
+@pytest.mark.parametrize("delimiter", [",", ", ", " ", "::"])
+def test_read_columns_matches_loadtxt(tmp_path, monkeypatch, delimiter):
+    """Columns read with pandas are identical to those from numpy.loadtxt."""
+    pytest.importorskip("pandas")
+    rng = np.random.default_rng(0)
+    data = rng.random((300, 4))*10**rng.uniform(-8, 8, (300, 4))
+    filename = tmp_path / "msd.csv"
+    np.savetxt(filename, data, delimiter=delimiter, fmt="%.17g", header=delimiter.join(["time", "a", "b", "c"]))
+
+    columns = msd._read_columns(filename, delimiter=delimiter)
+    monkeypatch.setitem(sys.modules, "pandas", None) # Import of pandas raises ImportError
+
+    assert np.array_equal(columns, data.T)
+    assert np.array_equal(columns, msd._read_columns(filename, delimiter=delimiter))
+
+
+def test_debye_waller_savgol_matches_spline():
+    """The Savitzky-Golay derivatives locate the same cage region as the spline."""
+    time = np.logspace(-2, 3, 400)
+    msd_array = 0.6*(1-np.exp(-time)) + 0.01*time + 0.03*time**2/(1+time**2)
+
+    dw_spline, tau_spline = msd.debye_waller(time, msd_array)
+    dw_savgol, tau_savgol = msd.debye_waller(time, msd_array, savgol_window=31)
+
+    assert np.isclose(dw_savgol, dw_spline, rtol=1e-3)
+    assert np.isclose(tau_savgol, tau_spline, rtol=1e-2)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"skip": 2},
+    {"min_Npts": 15, "skip": 3, "min_R2": 0.99},
+    {"min_exp": 0.999},
+    {"monotonic_early_exit": True},
+])
+def test_find_diffusivity_cython_matches_python(kwargs):
+    """The compiled region scan returns the same regions as the python implementation."""
+    pytest.importorskip("md_spa.cython_modules._diffusivity")
+    rng = np.random.default_rng(1)
+    time = np.linspace(0.1, 50, 90)
+    msd_array = 1.8*time + 2*(1-np.exp(-time)) + rng.normal(0, 0.1, len(time))*np.sqrt(time)
+
+    best_python, longest_python = msd.find_diffusivity(time, msd_array, flag="python", **kwargs)
+    best_cython, longest_cython = msd.find_diffusivity(time, msd_array, flag="cython", **kwargs)
+
+    for python, cython in [(best_python, best_cython), (longest_python, longest_cython)]:
+        assert python[-1] == cython[-1] # Number of points
+        assert np.array_equal(python[2:4], cython[2:4]) # Fit region
+        assert np.allclose(python, cython, rtol=1e-10, equal_nan=True)
+    assert not np.any(np.isnan(best_python))
+
+
+def _direct_particle_msd(coords):
+    """ MSD of each particle averaged over all time origins """
+    nparticles, npts, _ = np.shape(coords)
+    particle_msd = np.zeros((nparticles, npts))
+    for lag in range(1, npts):
+        displacement = coords[:, lag:, :] - coords[:, :-lag, :]
+        particle_msd[:, lag] = np.mean(np.sum(displacement**2, axis=2), axis=1)
+    return particle_msd
+
+
+def test_msd_standard_error_over_particles():
+    """The standard error is taken over the MSD curves of the individual particles."""
+    rng = np.random.default_rng(2)
+    coords = np.cumsum(rng.normal(size=(5, 40, 3)), axis=1)
+    particle_msd = _direct_particle_msd(coords)
+
+    msd_array, stderror = msd.msd(coords)
+
+    assert np.allclose(msd_array, np.mean(particle_msd, axis=0), atol=1e-10)
+    assert np.allclose(stderror, np.std(particle_msd, ddof=1, axis=0)/np.sqrt(len(coords)), atol=1e-10)
+
+
+def test_msd_single_particle():
+    """A single trajectory has an msd and no standard error."""
+    rng = np.random.default_rng(3)
+    coords = np.cumsum(rng.normal(size=(40, 3)), axis=0)
+
+    msd_array, stderror = msd.msd(coords)
+
+    assert np.allclose(msd_array, _direct_particle_msd(coords[None])[0], atol=1e-10)
+    assert np.all(np.isnan(stderror))